@@ -0,0 +1,215 @@
+"""Offline micro-benchmarki ścieżki krytycznej: parsowanie, ekstrakcja, formatowanie.
+
+Nie korzystają z sieci - dane wejściowe to zapisane odpowiedzi źródeł
+w benchmarks/fixtures (strony DuckDuckGo, JSON OpenCorporates i Wikipedia).
+
+Uruchomienie:
+    python benchmarks/bench.py                        # wszystkie benchmarki
+    python benchmarks/bench.py -k extract             # tylko pasujące do wzorca
+    python benchmarks/bench.py -o bench.json          # zapis wyników do JSON
+    python benchmarks/bench.py --compare bench.json   # porównanie z poprzednim przebiegiem
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from glob import glob
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def load_fixtures(pattern):
+    """Wczytaj pliki z katalogu fixtures jako bajty"""
+    fixtures = {}
+    for path in sorted(glob(os.path.join(FIXTURES_DIR, pattern))):
+        with open(path, 'rb') as f:
+            fixtures[os.path.splitext(os.path.basename(path))[0]] = f.read()
+    return fixtures
+
+def fixture_query(name):
+    """duckduckgo_apple -> apple"""
+    return name.split('_', 1)[1]
+
+def full_tree_parse(content):
+    """Dawna ścieżka: pełne drzewo html.parser, potem pierwsze 5 div.result"""
+    soup = BeautifulSoup(content, 'html.parser')
+    return [result.get_text() for result in soup.find_all('div', class_='result')[:5]]
+
+def cycling(func, inputs):
+    """Funkcja bez argumentów, która przy każdym wywołaniu bierze kolejne wejście"""
+    inputs = itertools.cycle(inputs)
+    return lambda: func(*next(inputs))
+
+def collect_benchmarks():
+    """Zwróć listę (nazwa, funkcja bez argumentów)"""
+    benchmarks = []
+    duckduckgo = load_fixtures('duckduckgo_*.html')
+    opencorporates = load_fixtures('opencorporates_*.json')
+    wikipedia = load_fixtures('wikipedia_*.json')
+
+    # Parsowanie odpowiedzi źródeł
+    for name, content in duckduckgo.items():
+        query = fixture_query(name)
+        benchmarks.append((f'parse/{name}/full_tree_baseline', lambda c=content: full_tree_parse(c)))
+        benchmarks.append((f'parse/{name}/iter_result_texts', lambda c=content: main.iter_result_texts(c)))
+        benchmarks.append((f'parse/{name}/parse_duckduckgo_results',
+                           lambda c=content, q=query: main.parse_duckduckgo_results(c, q)))
+    for name, content in opencorporates.items():
+        benchmarks.append((f'parse/{name}', lambda c=content: main.parse_opencorporates_response(c)))
+    for name, content in wikipedia.items():
+        benchmarks.append((f'parse/{name}', lambda c=content, q=fixture_query(name): main.parse_wikipedia_summary(c, q)))
+
+    # Ekstrakcja: teksty wyników DuckDuckGo i opisy Wikipedia
+    result_texts = [
+        (text, fixture_query(name))
+        for name, content in duckduckgo.items()
+        for text in main.iter_result_texts(content)
+    ]
+    summaries = [(json.loads(content)['extract'],) for content in wikipedia.values()]
+    descriptive_texts = summaries + [(text,) for text, _ in result_texts]
+
+    for func in (main.extract_company_name, main.extract_person_name):
+        benchmarks.append((f'extract/{func.__name__}', cycling(func, result_texts)))
+    for func in (main.extract_address, main.extract_business_id):
+        benchmarks.append((f'extract/{func.__name__}', cycling(func, [(text,) for text, _ in result_texts])))
+    for func in (main.extract_ceo_from_text, main.extract_address_from_text, main.extract_business_id_from_text):
+        benchmarks.append((f'extract/{func.__name__}', cycling(func, descriptive_texts)))
+    benchmarks.append(('extract/extract_fields', cycling(main.extract_fields, result_texts)))
+    benchmarks.append(('extract/extract_summary_fields', cycling(main.extract_summary_fields, descriptive_texts)))
+
+    # Formatowanie
+    addresses = [
+        (json.loads(content)['results']['companies'][0]['company']['registered_address_in_full'],)
+        for content in opencorporates.values()
+        if json.loads(content)['results']['companies']
+    ]
+    benchmarks.append(('format/format_address', cycling(main.format_address, addresses)))
+
+    info = {
+        'nazwa_firmy': 'Apple Inc',
+        'imie_nazwisko': 'Tim Cook',
+        'adres': 'One Apple Park Way, Cupertino, CA 95014',
+        'nip': '94-2404110',
+        'źródło': 'Google Business, International Registry',
+    }
+    default_template = main.get_default_template()
+    custom_template = '{nazwa_firmy} | {imie_nazwisko} | {adres} | {nip} | {data}'
+    benchmarks.append(('format/format_response/default', lambda: main.format_response(info, default_template)))
+    benchmarks.append(('format/format_response/custom', lambda: main.format_response(info, custom_template)))
+    compiled_template = main.compile_template(custom_template)
+    benchmarks.append(('format/format_response/compiled', lambda: main.format_response(info, compiled_template)))
+    benchmarks.append(('format/compile_template', lambda: main.compile_template(default_template)))
+
+    return benchmarks
+
+def measure(func, min_time):
+    """Wywołuj func aż minie min_time; zwróć (operacje/s, µs CPU na operację)"""
+    func()  # rozgrzewka
+    calls = 0
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    while time.perf_counter() - start_wall < min_time:
+        func()
+        calls += 1
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+    return calls / wall, cpu / calls * 1e6
+
+def measure_allocations(func, calls=20):
+    """Szczytowa i pozostała (po wywołaniu) pamięć zaalokowana przez jedno wywołanie, w bajtach"""
+    tracemalloc.start()
+    try:
+        peaks, retained = [], []
+        for _ in range(calls):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            func()
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(after - before)
+    finally:
+        tracemalloc.stop()
+    return sorted(peaks)[len(peaks) // 2], sorted(retained)[len(retained) // 2]
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(FIXTURES_DIR),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(pattern=None, min_time=0.5):
+    results = {}
+    for name, func in collect_benchmarks():
+        if pattern and pattern not in name:
+            continue
+        ops_per_s, cpu_us = measure(func, min_time)
+        peak_bytes, retained_bytes = measure_allocations(func)
+        results[name] = {
+            'ops_per_s': round(ops_per_s, 1),
+            'cpu_us_per_op': round(cpu_us, 2),
+            'alloc_peak_bytes': peak_bytes,
+            'alloc_retained_bytes': retained_bytes,
+        }
+        print(f"{name:<62}{ops_per_s:>12.0f}{cpu_us:>12.1f}{peak_bytes / 1024:>12.1f}")
+    return results
+
+def compare(results, previous, threshold):
+    """Wypisz zmianę ops/s względem poprzedniego przebiegu; zwróć listę regresji"""
+    regressions = []
+    print(f"\nPorównanie z {previous.get('commit') or 'poprzednim przebiegiem'} (próg regresji {threshold:.0f}%)")
+    for name, result in results.items():
+        old = previous['results'].get(name)
+        if not old:
+            continue
+        change = (result['ops_per_s'] / old['ops_per_s'] - 1) * 100
+        marker = ''
+        if change < -threshold:
+            marker = '  ⚠️ REGRESJA'
+            regressions.append(name)
+        print(f"{name:<62}{change:>+10.1f}%{marker}")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline micro-benchmarki bota')
+    parser.add_argument('-k', dest='pattern', help='uruchom tylko benchmarki zawierające ten tekst')
+    parser.add_argument('-o', '--output', help='zapisz wyniki do pliku JSON')
+    parser.add_argument('--compare', help='plik JSON z poprzedniego przebiegu')
+    parser.add_argument('--threshold', type=float, default=10.0, help='spadek ops/s (w %%) uznawany za regresję')
+    parser.add_argument('--min-time', type=float, default=0.5, help='czas pomiaru jednego benchmarku (s)')
+    args = parser.parse_args()
+
+    print(f"Parser DuckDuckGo: {'lxml' if main.get_etree() is not None else 'html.parser + SoupStrainer'}")
+    print(f"{'benchmark':<62}{'ops/s':>12}{'µs CPU/op':>12}{'peak KiB':>12}")
+    results = run(args.pattern, args.min_time)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'parser': 'lxml' if main.get_etree() is not None else 'html.parser',
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nZapisano: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(1)
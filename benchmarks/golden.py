@@ -0,0 +1,70 @@
+"""Sprawdzenie ekstrakcji względem złotego korpusu.
+
+benchmarks/fixtures/golden_extraction.json zawiera teksty wejściowe (wyniki
+DuckDuckGo, opisy Wikipedia i deterministycznie wygenerowane kombinacje
+fragmentów z nazwami firm, adresami, osobami i identyfikatorami) razem
+z wynikami pierwotnych funkcji extract_* z commita bazowego. Każda
+optymalizacja silnika ekstrakcji musi zwracać dokładnie te same wartości.
+
+Uruchomienie:
+    python benchmarks/golden.py        # kod wyjścia 1 przy jakiejkolwiek różnicy
+    python benchmarks/golden.py -v     # wypisz wszystkie różnice, nie tylko pierwsze
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+GOLDEN_PATH = os.path.join(FIXTURES_DIR, 'golden_extraction.json')
+
+TEXT_CHECKS = {
+    'extract_company_name': lambda text, query: main.extract_company_name(text, query),
+    'extract_address': lambda text, query: main.extract_address(text),
+    'extract_person_name': lambda text, query: main.extract_person_name(text, query),
+    'extract_business_id': lambda text, query: main.extract_business_id(text),
+    'extract_ceo_from_text': lambda text, query: main.extract_ceo_from_text(text),
+    'extract_address_from_text': lambda text, query: main.extract_address_from_text(text),
+    'extract_business_id_from_text': lambda text, query: main.extract_business_id_from_text(text),
+    'format_address': lambda text, query: main.format_address(text),
+    'extract_fields': lambda text, query: main.extract_fields(text, query),
+}
+
+def check(golden):
+    """Zwróć listę różnic (opis, oczekiwane, otrzymane)"""
+    mismatches = []
+    for index, case in enumerate(golden['texts']):
+        for name, expected in case['expected'].items():
+            actual = TEXT_CHECKS[name](case['text'], case['query'])
+            if actual != expected:
+                mismatches.append((f"texts[{index}] {name}({case['text'][:60]!r}, {case['query']!r})", expected, actual))
+
+    for case in golden['duckduckgo']:
+        with open(os.path.join(FIXTURES_DIR, case['fixture']), 'rb') as f:
+            content = f.read()
+        actual = main.parse_duckduckgo_results(content, case['query'])
+        if actual != case['expected']:
+            mismatches.append((f"parse_duckduckgo_results({case['fixture']}, {case['query']!r})", case['expected'], actual))
+
+    return mismatches
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Porównanie ekstrakcji ze złotym korpusem')
+    parser.add_argument('-v', '--verbose', action='store_true', help='wypisz wszystkie różnice')
+    args = parser.parse_args()
+
+    with open(GOLDEN_PATH, encoding='utf-8') as f:
+        golden = json.load(f)
+
+    print(f"Parser DuckDuckGo: {'lxml' if main.get_etree() is not None else 'html.parser + SoupStrainer'}")
+    mismatches = check(golden)
+    checked = sum(len(case['expected']) for case in golden['texts']) + len(golden['duckduckgo'])
+    print(f"Sprawdzono {checked} wyników względem {golden['baseline']}, różnic: {len(mismatches)}")
+
+    for description, expected, actual in mismatches if args.verbose else mismatches[:10]:
+        print(f"\n{description}\n  oczekiwane: {expected!r}\n  otrzymane:  {actual!r}")
+
+    sys.exit(1 if mismatches else 0)
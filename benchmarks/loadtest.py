@@ -0,0 +1,386 @@
+"""Test obciążeniowy end-to-end: prawdziwy bot (python main.py) przeciw lokalnym atrapom.
+
+Uruchamia w jednym procesie atrapę Telegram Bot API (getUpdates / sendMessage /
+editMessageText) i atrapy źródeł (DuckDuckGo, OpenCorporates, Wikipedia)
+z opóźnieniem i wstrzykiwaniem błędów, a bota jako podproces wskazany na nie
+przez BOT_API_URL i *_URL. Zapytania o NIP obsługuje lokalny indeks NIP
+(KRS/CEIDG) zbudowany z wygenerowanego zrzutu CSV.
+
+Symulowani użytkownicy piszą do bota w zamkniętej pętli: kolejna wiadomość
+dopiero po ostatecznej odpowiedzi na poprzednią (plus czas do namysłu).
+Opóźnienie = od wysłania wiadomości do ostatecznej treści odpowiedzi.
+
+Uruchomienie:
+    python benchmarks/loadtest.py                              # 1000 użytkowników x 3 wiadomości
+    python benchmarks/loadtest.py --users 5000 --latency 300   # wolniejsze źródła
+    python benchmarks/loadtest.py --error-rate 0.2 --hang-rate 0.05
+    python benchmarks/loadtest.py -o loadtest.json             # zapis wyników do JSON
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from urllib.parse import parse_qs, unquote
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main  # noqa: E402
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(ROOT_DIR, 'benchmarks', 'fixtures')
+BOT_TOKEN = '123456:LOADTEST'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Load Test Bot', 'username': 'loadtest_bot'}
+
+NAME_WORDS = (
+    'Alfa', 'Beta', 'Delta', 'Polmet', 'Agro', 'Budex', 'Transkom', 'Elektro', 'Medica', 'Nova',
+    'Orion', 'Vistula', 'Baltic', 'Silesia', 'Mazovia', 'Tech', 'Logistics', 'Foods', 'Energy', 'Systems',
+)
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+def random_company(rng):
+    return f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} {rng.randint(1, 99)}"
+
+def random_nip(rng):
+    """Losowy NIP z poprawną sumą kontrolną"""
+    while True:
+        digits = [rng.randint(0, 9) for _ in range(9)]
+        checksum = sum(weight * digit for weight, digit in zip(main.NIP_WEIGHTS, digits)) % 11
+        if checksum != 10:
+            return ''.join(map(str, digits)) + str(checksum)
+
+def write_nip_dump(path, nips, rng):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['nip', 'nazwa', 'adres', 'imie_nazwisko'])
+        for nip in nips:
+            writer.writerow([nip, f"{random_company(rng)} Sp. z o.o.", 'ul. Testowa 1, 00-001 Warszawa', 'Jan Kowalski'])
+
+def rss_kib(pid):
+    """Bieżący RSS procesu (Linux, /proc) w KiB albo None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+class FakeBotApi:
+    """Atrapa Bot API: kolejka aktualizacji dla getUpdates i rejestr odpowiedzi bota"""
+
+    def __init__(self):
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.new_updates = asyncio.Event()
+        self.polling = asyncio.Event()
+        self.waiting = {}  # czat -> (future ostatecznej odpowiedzi, czas wysłania)
+        self.calls = {}
+
+    def send_user_message(self, chat_id, text):
+        """Użytkownik pisze do bota; zwróć future z (opóźnienie, treść odpowiedzi)"""
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[chat_id] = (future, time.perf_counter())
+        self.updates.append({
+            'update_id': self.next_update_id,
+            'message': {
+                'message_id': self._message_id(),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id}'},
+                'text': text,
+            },
+        })
+        self.next_update_id += 1
+        self.new_updates.set()
+        return future
+
+    def _message_id(self):
+        self.next_message_id += 1
+        return self.next_message_id
+
+    def _reply(self, chat_id, text):
+        """Odpowiedź bota: ostateczna, jeśli to nie placeholder ani wynik częściowy"""
+        if text.startswith('🔍 **LIVE SEARCH:**') or text.endswith(main.PROGRESS_SUFFIX):
+            return
+        waiting = self.waiting.pop(chat_id, None)
+        if waiting is not None and not waiting[0].done():
+            future, sent_at = waiting
+            future.set_result((time.perf_counter() - sent_at, text))
+
+    async def get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        if offset:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        self.polling.set()
+        if not self.updates:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get('limit') or 100)
+        return self.updates[:limit]
+
+    async def routes(self, method, path, headers, body):
+        """Handler dla main.start_http_server: POST /bot<token>/<metoda>"""
+        api_method = path.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if headers.get('content-type', '').startswith('application/json'):
+            params = json.loads(body or b'{}')
+        else:
+            params = {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+
+        if api_method == 'getMe':
+            result = BOT_USER
+        elif api_method == 'getUpdates':
+            result = await self.get_updates(params)
+        elif api_method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params['chat_id'])
+            result = {
+                'message_id': int(params.get('message_id') or self._message_id()),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': params['text'],
+            }
+            self._reply(chat_id, params['text'])
+        else:
+            result = True
+        return 200, 'application/json', json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+class FakeUpstreams:
+    """Atrapy źródeł: odpowiedzi z fixtures, losowe opóźnienie, błędy 503 i zawieszenia"""
+
+    def __init__(self, latency, error_rate, hang_rate, rng):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.rng = rng
+        self.requests = 0
+        self.closing = asyncio.Event()
+        with open(os.path.join(FIXTURES_DIR, 'duckduckgo_generic.html'), 'rb') as f:
+            self.duckduckgo = f.read()
+        with open(os.path.join(FIXTURES_DIR, 'opencorporates_apple.json'), 'rb') as f:
+            self.opencorporates = f.read()
+        with open(os.path.join(FIXTURES_DIR, 'wikipedia_apple.json'), 'rb') as f:
+            self.wikipedia = json.load(f)
+
+    async def routes(self, method, path, headers, body):
+        self.requests += 1
+        if self.rng.random() < self.hang_rate:
+            # Dłużej niż jakikolwiek limit czasu źródła (przerywane na koniec testu)
+            try:
+                await asyncio.wait_for(self.closing.wait(), 60)
+            except asyncio.TimeoutError:
+                pass
+        await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.latency)
+        if self.rng.random() < self.error_rate:
+            return 503, 'text/plain', b'Service Unavailable'
+
+        if path.startswith('/duckduckgo/'):
+            return 200, 'text/html; charset=utf-8', self.duckduckgo
+        if path.startswith('/opencorporates/'):
+            return 200, 'application/json', self.opencorporates
+        if path.startswith('/wikipedia/'):
+            title = unquote(path.rsplit('/', 1)[-1]).replace('+', ' ')
+            return 200, 'application/json', json.dumps({**self.wikipedia, 'title': title}).encode('utf-8')
+        return 404, 'text/plain', b'Not Found'
+
+async def simulate_user(api, chat_id, queries, args, rng, results):
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+    for query in queries:
+        try:
+            latency, text = await asyncio.wait_for(api.send_user_message(chat_id, query), args.reply_timeout)
+        except asyncio.TimeoutError:
+            api.waiting.pop(chat_id, None)
+            results.append((None, 'timeout'))
+            continue
+        results.append((latency, 'error' if text.startswith('❌') else 'ok'))
+        if args.think_time:
+            await asyncio.sleep(rng.expovariate(1 / args.think_time))
+
+async def wait_for_bot(process, health_url, api, timeout=60):
+    """Czekaj, aż bot odpowie na /health i zacznie odpytywać getUpdates"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Bot zakończył działanie (kod {process.returncode})")
+            try:
+                if (await client.get(health_url)).status_code == 200 and api.polling.is_set():
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError('Bot nie wystartował na czas')
+
+async def run(args):
+    rng = random.Random(args.seed)
+    api = FakeBotApi()
+    upstreams = FakeUpstreams(args.latency / 1000, args.error_rate, args.hang_rate, rng)
+    api_server = await main.start_http_server(api.routes, args.api_port, host='127.0.0.1')
+    upstream_server = await main.start_http_server(upstreams.routes, args.upstream_port, host='127.0.0.1')
+    api_url = f"http://127.0.0.1:{api_server.sockets[0].getsockname()[1]}"
+    upstream_url = f"http://127.0.0.1:{upstream_server.sockets[0].getsockname()[1]}"
+
+    # Pula zapytań: nazwy firm i NIP-y ze zrzutu dla lokalnego indeksu
+    nips = [random_nip(rng) for _ in range(max(1, args.distinct // 10))]
+    pool = [random_company(rng) for _ in range(args.distinct)]
+
+    with tempfile.TemporaryDirectory(prefix='loadtest-') as data_dir:
+        dump_path = os.path.join(data_dir, 'nip_dump.csv')
+        write_nip_dump(dump_path, nips, rng)
+        log_path = args.log or os.path.join(data_dir, 'bot.log')
+        env = {
+            **os.environ,
+            'BOT_TOKEN': BOT_TOKEN,
+            'BOT_API_URL': api_url,
+            'DUCKDUCKGO_URL': f'{upstream_url}/duckduckgo/html/',
+            'OPENCORPORATES_URL': f'{upstream_url}/opencorporates/companies/search',
+            'WIKIPEDIA_URL': f'{upstream_url}/wikipedia/',
+            'DATA_DIR': data_dir,
+            'NIP_DUMP_PATH': dump_path,
+            'PORT': str(args.bot_port),
+            'PYTHONUNBUFFERED': '1',
+        }
+        if args.rate_limits:
+            env['RATE_LIMITS'] = args.rate_limits
+
+        with open(log_path, 'w') as log:
+            process = subprocess.Popen(
+                [sys.executable, os.path.join(ROOT_DIR, 'main.py')],
+                env=env, stdout=log, stderr=subprocess.STDOUT, cwd=data_dir,
+            )
+        try:
+            await wait_for_bot(process, f'http://127.0.0.1:{args.bot_port}/health', api)
+            print(f"🤖 Bot gotowy (pid {process.pid}), RSS {rss_kib(process.pid) or '?'} KiB, log: {log_path}")
+
+            rss_samples = []
+
+            async def sample_rss():
+                while True:
+                    rss = rss_kib(process.pid)
+                    if rss:
+                        rss_samples.append(rss)
+                    await asyncio.sleep(0.5)
+
+            sampler = asyncio.create_task(sample_rss())
+            results = []
+            started = time.perf_counter()
+            users = []
+            for user in range(args.users):
+                queries = [
+                    rng.choice(nips) if rng.random() < args.nip_ratio else rng.choice(pool)
+                    for _ in range(args.messages)
+                ]
+                users.append(simulate_user(api, 1000 + user, queries, args, random.Random(rng.random()), results))
+
+            progress = asyncio.create_task(report_progress(results, args.users * args.messages, started))
+            await asyncio.gather(*users)
+            elapsed = time.perf_counter() - started
+            progress.cancel()
+            sampler.cancel()
+
+            async with httpx.AsyncClient() as client:
+                health = (await client.get(f'http://127.0.0.1:{args.bot_port}/health')).json()
+        finally:
+            process.terminate()
+            try:
+                await asyncio.to_thread(process.wait, 15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            upstreams.closing.set()
+            api.new_updates.set()  # obudź zawieszone getUpdates
+            api_server.close()
+            upstream_server.close()
+            # Połączenia od zakończonego bota domkną się same (EOF)
+            await asyncio.sleep(0.5)
+
+    latencies = [latency for latency, _ in results if latency is not None]
+    outcomes = {}
+    for _, outcome in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'log')},
+        'elapsed_s': round(elapsed, 2),
+        'replies': len(latencies),
+        'outcomes': outcomes,
+        'throughput_per_s': round(len(latencies) / elapsed, 2),
+        'latency_ms': {
+            name: round(percentile(latencies, q) * 1000, 1) if latencies else None
+            for name, q in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))
+        },
+        'rss_kib': {
+            'peak': max(rss_samples, default=None),
+            'final': rss_samples[-1] if rss_samples else None,
+        },
+        'upstream_requests': upstreams.requests,
+        'bot_api_calls': api.calls,
+        'sources': health.get('sources'),
+        'startup': health.get('startup'),
+    }
+
+async def report_progress(results, total, started):
+    while True:
+        await asyncio.sleep(5)
+        done = len(results)
+        print(f"   {done}/{total} odpowiedzi, {done / (time.perf_counter() - started):.1f}/s")
+
+def print_report(report):
+    latency = report['latency_ms']
+    print(f"\n{'czas':<28}{report['elapsed_s']:>12.1f} s")
+    print(f"{'odpowiedzi':<28}{report['replies']:>12} {report['outcomes']}")
+    print(f"{'przepustowość':<28}{report['throughput_per_s']:>12.1f} /s")
+    for name in ('p50', 'p95', 'p99', 'max'):
+        print(f"{'opóźnienie ' + name:<28}{latency[name] or 0:>12.1f} ms")
+    print(f"{'RSS bota (szczyt / koniec)':<28}{report['rss_kib']['peak'] or 0:>12} / {report['rss_kib']['final'] or 0} KiB")
+    print(f"{'zapytania do źródeł':<28}{report['upstream_requests']:>12}")
+    print(f"{'wywołania Bot API':<28}{report['bot_api_calls']}")
+    startup = report['startup'] or {}
+    print(f"{'start bota':<28}" + ', '.join(
+        f"{name} {startup[name]}s" for name in ('imports', 'ready', 'warm', 'first_reply') if startup.get(name) is not None
+    ))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Test obciążeniowy bota z atrapą Bot API i źródeł')
+    parser.add_argument('--users', type=int, default=1000, help='liczba symulowanych użytkowników')
+    parser.add_argument('--messages', type=int, default=3, help='wiadomości na użytkownika')
+    parser.add_argument('--distinct', type=int, default=2000, help='liczba różnych nazw firm w puli zapytań')
+    parser.add_argument('--nip-ratio', type=float, default=0.1, help='odsetek zapytań o NIP (lokalny indeks)')
+    parser.add_argument('--ramp', type=float, default=10.0, help='czas rozruchu użytkowników (s)')
+    parser.add_argument('--think-time', type=float, default=1.0, help='średni czas do namysłu między wiadomościami (s)')
+    parser.add_argument('--latency', type=float, default=150.0, help='średnie opóźnienie źródeł (ms)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='odsetek odpowiedzi 503 ze źródeł')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='odsetek zawieszonych zapytań do źródeł')
+    parser.add_argument('--reply-timeout', type=float, default=60.0, help='limit czekania na odpowiedź bota (s)')
+    parser.add_argument('--rate-limits', help='RATE_LIMITS dla bota, np. "127.0.0.1=50/100"')
+    parser.add_argument('--api-port', type=int, default=0, help='port atrapy Bot API (0 = wolny)')
+    parser.add_argument('--upstream-port', type=int, default=0, help='port atrap źródeł (0 = wolny)')
+    parser.add_argument('--bot-port', type=int, default=18080, help='port serwera HTTP bota (/health)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log', help='plik na wyjście bota (domyślnie w katalogu tymczasowym)')
+    parser.add_argument('-o', '--output', help='zapisz wyniki do pliku JSON')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nZapisano: {args.output}")
@@ -1,28 +1,34 @@
+import time
+
+# Początek startu procesu - punkt odniesienia dla faz startu i czasu do pierwszej odpowiedzi
+PROCESS_STARTED = time.perf_counter()
+
 import os
+import asyncio
 import logging
-import requests
 import re
 import json
+import csv
+import sys
+import sqlite3
+import threading
+import contextvars
+import importlib.util
+import signal
+import secrets
+import socket
+import string
+from http import HTTPStatus
+from io import BytesIO, StringIO
+from collections import OrderedDict, deque
 from datetime import datetime
-from bs4 import BeautifulSoup
-from urllib.parse import quote_plus
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
-from threading import Thread
-from http.server import HTTPServer, BaseHTTPRequestHandler
-
-# Prosty serwer HTTP dla Render
-class HealthHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(b'Live Business Search Bot is running!')
-
-def run_server():
-    port = int(os.environ.get('PORT', 10000))
-    server = HTTPServer(('0.0.0.0', port), HealthHandler)
-    print(f"HTTP server running on port {port}")
-    server.serve_forever()
+from urllib.parse import quote_plus, urlsplit
+import httpx
+from telegram import InlineQueryResultArticle, InputTextMessageContent, Update
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import (
+    Application, BaseUpdateProcessor, CommandHandler, InlineQueryHandler, MessageHandler, ContextTypes, filters
+)
 
 # Włącz logowanie
 logging.basicConfig(
@@ -30,12 +36,452 @@ logging.basicConfig(
     level=logging.INFO
 )
 
-# Przechowywanie szablonów użytkowników
-user_templates = {}
+# === START (zimny start) ===
+# Fazy startu w sekundach od PROCESS_STARTED; raportowane w /health i /metrics.
+# Ciężkie importy (bs4, lxml, pula procesów) są odroczone do pierwszego użycia,
+# a połączenia do źródeł rozgrzewane w tle zaraz po starcie.
+STARTUP_PREWARM = os.environ.get('STARTUP_PREWARM', '1') == '1'
+startup_phases = {}
+startup_milestones = {'imports': None, 'ready': None, 'warm': None, 'first_reply': None}
+
+def mark_milestone(name, report=True):
+    """Zapisz moment startu (tylko pierwszy raz), w sekundach od początku procesu"""
+    if startup_milestones.get(name) is None:
+        startup_milestones[name] = round(time.perf_counter() - PROCESS_STARTED, 4)
+        if report:
+            report_milestone(name)
+
+def report_milestone(name):
+    print(f"⏱️ Start: {name} po {startup_milestones[name]}s")
+
+class startup_phase:
+    """Zmierz fazę startu (czas trwania w sekundach)"""
+    
+    def __init__(self, name):
+        self.name = name
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        startup_phases[self.name] = round(time.perf_counter() - self.start, 4)
+        return False
+
+def startup_snapshot():
+    return {**startup_milestones, 'phases': dict(startup_phases)}
+
+# === METRYKI I ŚLEDZENIE ===
+# Metryki w formacie tekstowym Prometheusa, serwowane pod /metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 20)
+TRACE_QUERIES = os.environ.get('TRACE_QUERIES', '1') == '1'
+EVENT_LOOP_LAG_INTERVAL = float(os.environ.get('EVENT_LOOP_LAG_INTERVAL', 0.5))
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+class Metric:
+    """Licznik (counter) lub wartość chwilowa (gauge) z etykietami"""
+    
+    def __init__(self, name, help_text, kind='counter'):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.values = {}
+    
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+    
+    def set(self, value, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        for labels, value in list(self.values.items()):
+            lines.append(f'{self.name}{_format_labels(labels)} {value}')
+        return lines
+
+class Histogram(Metric):
+    """Histogram z ustalonymi kubełkami (sekundy)"""
+    
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, 'histogram')
+        self.buckets = buckets
+    
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['counts'][i] += 1
+        series['sum'] += value
+        series['count'] += 1
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in list(self.values.items()):
+            for bound, count in zip(self.buckets, series['counts']):
+                lines.append(f'{self.name}_bucket{_format_labels(labels + (("le", bound),))} {count}')
+            lines.append(f'{self.name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {series["count"]}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {series["sum"]}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {series["count"]}')
+        return lines
+
+METRICS = {}
+
+def register_metric(metric):
+    METRICS[metric.name] = metric
+    return metric
+
+searches_total = register_metric(Metric('bot_searches_total', 'Obsłużone wyszukiwania wg wyniku'))
+commands_total = register_metric(Metric('bot_commands_total', 'Obsłużone komendy'))
+source_requests_total = register_metric(Metric('bot_source_requests_total', 'Zapytania do źródeł wg wyniku'))
+source_latency = register_metric(Histogram('bot_source_latency_seconds', 'Czas odpowiedzi źródeł'))
+stage_duration = register_metric(Histogram('bot_stage_duration_seconds', 'Czas etapów obsługi zapytania'))
+event_loop_lag = register_metric(Histogram('bot_event_loop_lag_seconds', 'Opóźnienie pętli zdarzeń asyncio'))
+http_cache_requests_total = register_metric(Metric('bot_http_cache_requests_total', 'Zapytania przez cache HTTP wg wyniku'))
+
+def collect_gauges():
+    """Wartości chwilowe liczone w momencie odczytu /metrics"""
+    lookups = result_cache.hits + result_cache.misses
+    gauges = [
+        ('bot_cache_hits_total', 'counter', 'Trafienia w cache wyników', [((), result_cache.hits)]),
+        ('bot_cache_misses_total', 'counter', 'Chybienia cache wyników', [((), result_cache.misses)]),
+        ('bot_cache_hit_ratio', 'gauge', 'Odsetek trafień w cache wyników',
+         [((), result_cache.hits / lookups if lookups else 0.0)]),
+        ('bot_http_cache_bytes', 'gauge', 'Rozmiar treści w cache HTTP', [((), http_cache.total_bytes or 0)]),
+        ('bot_name_index_entries', 'gauge', 'Wpisy w indeksie nazw firm', [((), name_index.entries or 0)]),
+        ('bot_startup_milestone_seconds', 'gauge', 'Sekundy od startu procesu do etapu startu',
+         [((('milestone', name),), value) for name, value in startup_milestones.items() if value is not None]),
+        ('bot_startup_phase_seconds', 'gauge', 'Czas trwania faz startu',
+         [((('phase', name),), value) for name, value in startup_phases.items()]),
+        ('bot_inflight_searches', 'gauge', 'Wyszukiwania w toku (po scaleniu identycznych)',
+         [((), len(_inflight_searches))]),
+        ('bot_upstream_queue_depth', 'gauge', 'Zapytania czekające na limit hosta',
+         [((('host', host),), scheduler.depth()) for host, scheduler in upstream_schedulers.items()]),
+        ('bot_source_circuit_open', 'gauge', 'Czy obwód źródła jest otwarty',
+         [((('source', label),), int(health.state != 'closed')) for label, health in source_health.items()]),
+    ]
+    lines = []
+    for name, kind, help_text, samples in gauges:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        lines += [f'{name}{_format_labels(labels)} {value}' for labels, value in samples]
+    return lines
+
+def render_metrics():
+    """Wszystkie metryki w formacie tekstowym Prometheusa"""
+    lines = []
+    for metric in list(METRICS.values()):
+        lines += metric.render()
+    lines += collect_gauges()
+    return '\n'.join(lines) + '\n'
+
+async def monitor_event_loop_lag():
+    """Mierz, o ile później niż zaplanowano budzi się pętla zdarzeń"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        event_loop_lag.observe(max(0.0, time.perf_counter() - start - EVENT_LOOP_LAG_INTERVAL))
+
+# Ślad bieżącego zapytania (dziedziczony przez zadania źródeł)
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+class QueryTrace:
+    """Czasy etapów jednego zapytania: fetch, parse, extract, merge, render, send"""
+    
+    def __init__(self, query, user_id=None):
+        self.trace_id = os.urandom(6).hex()
+        self.query = query
+        self.user_id = user_id
+        self.started = time.perf_counter()
+        self.spans = []
+    
+    def finish(self, status):
+        """Wypisz ślad jako jedną linię JSON"""
+        if not TRACE_QUERIES:
+            return
+        print(json.dumps({
+            'trace_id': self.trace_id,
+            'query': self.query,
+            'user_id': self.user_id,
+            'status': status,
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'spans': self.spans,
+        }, ensure_ascii=False))
+
+class trace_stage:
+    """Zmierz etap zapytania: histogram bot_stage_duration_seconds + wpis w śladzie"""
+    
+    def __init__(self, stage, **attributes):
+        self.stage = stage
+        self.attributes = attributes
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        stage_duration.observe(duration, stage=self.stage)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.spans.append({
+                'stage': self.stage,
+                'start_ms': round((self.start - trace.started) * 1000, 2),
+                'duration_ms': round(duration * 1000, 2),
+                **self.attributes,
+                **({'error': exc_type.__name__} if exc_type else {}),
+            })
+        return False
+
+# === KLIENT HTTP ===
+# Wspólny, nieblokujący klient HTTP dla wszystkich źródeł (keep-alive + pula połączeń)
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_KEEPALIVE = int(os.environ.get('HTTP_MAX_KEEPALIVE', 20))
+HTTP_MAX_PER_HOST = int(os.environ.get('HTTP_MAX_PER_HOST', 10))
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# HTTP/2 jest opcjonalne (pip install httpx[http2]); h2 importuje dopiero klient
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+# Jak długo trzymać bezczynne połączenie (także rozgrzane przy starcie)
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('HTTP_KEEPALIVE_EXPIRY', 60))
+
+_http_client = None
+_host_semaphores = {}
+
+def get_http_client():
+    """Zwróć współdzielonego klienta HTTP (tworzony przy pierwszym użyciu)"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            headers=DEFAULT_HEADERS,
+            http2=HTTP2_AVAILABLE,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _http_client
+
+async def http_get(url, params=None, headers=None, timeout=10):
+    """GET przez wspólny klient z limitem równoległych połączeń na host"""
+    host = urlsplit(url).hostname
+    scheduler = upstream_schedulers.get(host)
+    if scheduler is not None:
+        # Żeton zużywa tylko zapytanie, które naprawdę idzie do sieci; czekanie
+        # w kolejce nie liczy się do czasu ani limitu czasu źródła
+        timer = source_timer.get()
+        if timer is not None:
+            timer.pause()
+        try:
+            await scheduler.acquire(search_user.get(), search_priority.get())
+        finally:
+            if timer is not None:
+                timer.resume()
+    
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = _host_semaphores[host] = asyncio.Semaphore(HTTP_MAX_PER_HOST)
+    
+    async with semaphore:
+        with trace_stage('fetch', host=host):
+            response = await get_http_client().get(url, params=params, headers=headers, timeout=timeout)
+    
+    # Limit zapytań i awarie serwera to błędy źródła, a nie "brak wyników"
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+    return response
+
+# === HARMONOGRAM ZAPYTAŃ DO ŹRÓDEŁ ===
+# Limity na host: (zapytań na sekundę, maksymalny zryw); nadpisanie przez
+# RATE_LIMITS="html.duckduckgo.com=1/3,api.opencorporates.com=0.5/2"
+UPSTREAM_RATE_LIMITS = {
+    'html.duckduckgo.com': (1.0, 3),
+    'api.opencorporates.com': (0.5, 2),
+    'en.wikipedia.org': (10.0, 20),
+}
+for _limit in filter(None, os.environ.get('RATE_LIMITS', '').split(',')):
+    _host, _, _rate = _limit.partition('=')
+    _per_second, _, _burst = _rate.partition('/')
+    try:
+        _per_second, _burst = float(_per_second), int(_burst or 1)
+    except ValueError:
+        _per_second = _burst = 0
+    if _per_second <= 0 or _burst < 1:
+        print(f"⚠️ Pomijam nieprawidłowy limit w RATE_LIMITS: {_limit!r} (wymagane zapytania/s > 0, zryw >= 1)")
+        continue
+    UPSTREAM_RATE_LIMITS[_host.strip()] = (_per_second, _burst)
+
+# Niższa liczba = wyższy priorytet
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Kto i z jakim priorytetem odpytuje źródła (dziedziczone przez zadania asyncio)
+search_user = contextvars.ContextVar('search_user', default=None)
+search_priority = contextvars.ContextVar('search_priority', default=PRIORITY_INTERACTIVE)
+# Pomiar czasu bieżącego wywołania źródła (fetch_source), wstrzymywany przez http_get
+source_timer = contextvars.ContextVar('source_timer', default=None)
+
+class SourceTimer:
+    """Czas wywołania źródła z pominięciem czekania na żeton hosta (limit czasu też stoi)"""
+    
+    def __init__(self, deadline):
+        self.deadline = deadline  # asyncio.Timeout wywołania
+        self.start = time.perf_counter()
+        self._paused_at = None
+        self._remaining = None
+    
+    def pause(self):
+        self._paused_at = time.perf_counter()
+        when = self.deadline.when()
+        self._remaining = None if when is None else when - asyncio.get_running_loop().time()
+        if not self.deadline.expired():
+            self.deadline.reschedule(None)
+    
+    def resume(self):
+        self.start += time.perf_counter() - self._paused_at
+        if self._remaining is not None and not self.deadline.expired():
+            self.deadline.reschedule(asyncio.get_running_loop().time() + self._remaining)
+    
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+class TokenBucket:
+    """Kubełek żetonów: `rate` żetonów na sekundę, najwyżej `capacity` naraz"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def try_take(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+    
+    def wait_time(self):
+        """Ile sekund do następnego żetonu"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+class UpstreamScheduler:
+    """Kolejka zapytań do jednego hosta: token bucket + sprawiedliwa kolejka per użytkownik.
+    
+    Oczekujący są obsługiwani według priorytetu, a w obrębie priorytetu
+    na zmianę (round-robin) między użytkownikami - jeden użytkownik
+    wysyłający serię zapytań nie zagłodzi pozostałych.
+    """
+    
+    def __init__(self, host, rate, burst):
+        self.host = host
+        self.bucket = TokenBucket(rate, burst)
+        self.queues = {}  # priorytet -> OrderedDict(użytkownik -> deque[(future, czas wejścia)])
+        self.waits = deque(maxlen=200)
+        self._dispatcher = None
+    
+    def depth(self):
+        return sum(len(waiters) for users in self.queues.values() for waiters in users.values())
+    
+    async def acquire(self, user=None, priority=PRIORITY_INTERACTIVE):
+        """Poczekaj na swoją kolej i żeton dla hosta"""
+        if not self.depth() and self.bucket.try_take():
+            self.waits.append(0.0)
+            return
+        
+        future = asyncio.get_running_loop().create_future()
+        waiters = self.queues.setdefault(priority, OrderedDict()).setdefault(user, deque())
+        waiters.append((future, time.monotonic()))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        
+        try:
+            await future
+        except asyncio.CancelledError:
+            self._discard(priority, user, future)
+            raise
+    
+    def _discard(self, priority, user, future):
+        waiters = self.queues.get(priority, {}).get(user)
+        if not waiters:
+            return
+        for entry in list(waiters):
+            if entry[0] is future:
+                waiters.remove(entry)
+        if not waiters:
+            del self.queues[priority][user]
+    
+    def _next_waiter(self):
+        for priority in sorted(self.queues):
+            users = self.queues[priority]
+            while users:
+                # Pierwszy użytkownik w kolejce, potem wraca na jej koniec
+                user, waiters = users.popitem(last=False)
+                future, enqueued_at = waiters.popleft()
+                if waiters:
+                    users[user] = waiters
+                if not future.done():
+                    return future, enqueued_at
+        return None
+    
+    async def _dispatch(self):
+        while self.depth():
+            delay = self.bucket.wait_time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            self.bucket.try_take()
+            future, enqueued_at = waiter
+            self.waits.append(time.monotonic() - enqueued_at)
+            future.set_result(None)
+    
+    def snapshot(self):
+        waits = sorted(self.waits)
+        return {
+            'queue_depth': self.depth(),
+            'waiting_users': len({user for users in self.queues.values() for user in users}),
+            'rate_per_s': self.bucket.rate,
+            'burst': self.bucket.capacity,
+            'wait_avg_s': round(sum(waits) / len(waits), 3) if waits else 0.0,
+            'wait_p95_s': round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 3) if waits else 0.0,
+        }
+
+upstream_schedulers = {
+    host: UpstreamScheduler(host, rate, burst) for host, (rate, burst) in UPSTREAM_RATE_LIMITS.items()
+}
+
+async def close_http_client():
+    """Zamknij klienta HTTP przy wyłączaniu bota"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
 
 # === PODSTAWOWE KOMENDY ===
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Komenda /start - powitanie"""
+    commands_total.inc(command='start')
     welcome_text = """
 🔍 **BOT WYSZUKIWANIA FIRM - LIVE INTERNET**
 
@@ -53,8 +499,11 @@ Bot **na żywo przeszuka internet** i zwróci:
 📍 **Adres** (siedziba)
 💼 **NIP** (numer identyfikacyjny)
 
+W dowolnym czacie możesz też wpisać `@nazwa_bota Apple`.
+
 **Komendy:**
 • `/szablon` - ustaw format odpowiedzi
+• `/batch` - wyszukiwanie wielu firm z pliku
 • `/help` - instrukcja
 
 🌐 *Bot wyszukuje w czasie rzeczywistym w polskich i międzynarodowych bazach*
@@ -63,6 +512,7 @@ Bot **na żywo przeszuka internet** i zwróci:
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Komenda /help - pomoc"""
+    commands_total.inc(command='help')
     help_text = """
 🔍 **INSTRUKCJA LIVE SEARCH**
 
@@ -86,66 +536,1082 @@ Bot przeszukuje na żywo:
 • `/szablon [format]` - nowy format
 • `/szablon reset` - domyślny
 
+**📦 BATCH:**
+• `/batch` - wyślij plik .txt/.csv z jedną firmą lub NIP w linii, wyniki wrócą jako CSV
+
 **Zmienne:**  
 `{nazwa_firmy}` `{imie_nazwisko}` `{adres}` `{nip}` `{data}`
 
-**⚡ Bot wyszukuje na żywo - każde zapytanie to nowe połączenie z internetem!**
+**⚡ Bot wyszukuje na żywo - świeże wyniki popularnych zapytań podaje z pamięci podręcznej!**
     """
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
+# === ZDROWIE ŹRÓDEŁ ===
+HEALTH_WINDOW = int(os.environ.get('HEALTH_WINDOW', 50))
+HEALTH_MIN_SAMPLES = int(os.environ.get('HEALTH_MIN_SAMPLES', 10))
+# Limit czasu = p95 * mnożnik, nie mniej niż minimum i nie więcej niż DEADLINE_* źródła
+TIMEOUT_P95_FACTOR = float(os.environ.get('TIMEOUT_P95_FACTOR', 1.5))
+TIMEOUT_MIN = float(os.environ.get('TIMEOUT_MIN', 2))
+# Obwód otwiera się przy tylu błędach w oknie i po przerwie przepuszcza jedno zapytanie próbne
+BREAKER_ERROR_RATE = float(os.environ.get('BREAKER_ERROR_RATE', 0.5))
+BREAKER_MIN_CALLS = int(os.environ.get('BREAKER_MIN_CALLS', 5))
+BREAKER_COOLDOWN = float(os.environ.get('BREAKER_COOLDOWN', 30))
+
+class SourceUnavailable(Exception):
+    """Źródło pominięte (otwarty obwód) albo zakończone błędem/przekroczeniem czasu"""
+
+class SourceHealth:
+    """Kroczące statystyki źródła: percentyle opóźnień, odsetek błędów, circuit breaker"""
+    
+    def __init__(self, name, max_timeout):
+        self.name = name
+        self.max_timeout = max_timeout
+        self.latencies = deque(maxlen=HEALTH_WINDOW)
+        self.outcomes = deque(maxlen=HEALTH_WINDOW)
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+    
+    def percentile(self, p):
+        samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+    
+    def error_rate(self):
+        outcomes = list(self.outcomes)
+        if not outcomes:
+            return 0.0
+        return outcomes.count(False) / len(outcomes)
+    
+    def timeout(self, probe=False):
+        """Limit czasu wyliczony z obserwowanego p95 (zapytanie próbne dostaje maksymalny)"""
+        if probe or len(self.latencies) < HEALTH_MIN_SAMPLES:
+            return self.max_timeout
+        return min(self.max_timeout, max(TIMEOUT_MIN, self.percentile(95) * TIMEOUT_P95_FACTOR))
+    
+    def allow_request(self):
+        """Zwróć (czy wolno teraz odpytać źródło, czy to zapytanie próbne półotwartego obwodu)"""
+        if self.state == 'closed':
+            return True, False
+        if self.state == 'open' and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN:
+            self.state = 'half_open'
+        if self.state == 'half_open' and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True, True
+        return False, False
+    
+    def record_success(self, latency, probe=False):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        if self.state == 'half_open':
+            print(f"🟢 {self.name}: źródło znowu działa, zamykam obwód")
+            self.state = 'closed'
+            self.outcomes.clear()
+        if probe:
+            self.probe_in_flight = False
+    
+    def record_failure(self, timed_out_after=None, probe=False):
+        """Błąd źródła; przekroczenie limitu czasu liczy się też jako próbka opóźnienia
+        równa limitowi, żeby p95 (a z nim limit) rósł, gdy źródło zwalnia"""
+        if timed_out_after is not None:
+            self.latencies.append(timed_out_after)
+        self.outcomes.append(False)
+        if probe:
+            self.probe_in_flight = False
+        if self.state == 'half_open' or (
+            self.state == 'closed'
+            and len(self.outcomes) >= BREAKER_MIN_CALLS
+            and self.error_rate() >= BREAKER_ERROR_RATE
+        ):
+            print(f"🔴 {self.name}: otwieram obwód na {BREAKER_COOLDOWN}s")
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            # Opóźnienia sprzed awarii nie mówią nic o tym, jak szybkie źródło jest teraz
+            self.latencies.clear()
+    
+    def release_probe(self):
+        """Zapytanie próbne anulowane z zewnątrz - nie liczymy go ani jako sukces, ani błąd"""
+        self.probe_in_flight = False
+    
+    def snapshot(self):
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            'state': self.state,
+            'timeout_s': round(self.timeout(), 3),
+            'p50_s': round(p50, 3) if p50 is not None else None,
+            'p95_s': round(p95, 3) if p95 is not None else None,
+            'error_rate': round(self.error_rate(), 3),
+            'samples': len(self.outcomes),
+        }
+
+async def fetch_source(label, search_func, query):
+    """Wywołaj źródło z adaptacyjnym limitem czasu, aktualizując jego statystyki"""
+    health = source_health[label]
+    allowed, probe = health.allow_request()
+    if not allowed:
+        source_requests_total.inc(source=label, outcome='skipped')
+        raise SourceUnavailable(f"{label}: obwód otwarty, pomijam")
+    
+    # Czekanie na żeton hosta (w http_get) to nie wolne źródło - SourceTimer
+    # wyłącza je z pomiaru i z limitu czasu
+    timeout = health.timeout(probe)
+    timer = None
+    try:
+        async with asyncio.timeout(timeout) as deadline:
+            timer = SourceTimer(deadline)
+            token = source_timer.set(timer)
+            try:
+                data = await search_func(query)
+            finally:
+                source_timer.reset(token)
+    except asyncio.CancelledError:
+        if probe:
+            health.release_probe()
+        source_requests_total.inc(source=label, outcome='cancelled')
+        raise
+    except Exception as e:
+        latency = timer.elapsed()
+        timed_out = isinstance(e, asyncio.TimeoutError)
+        health.record_failure(timeout if timed_out else None, probe)
+        source_latency.observe(latency, source=label)
+        outcome = 'timeout' if timed_out else 'error'
+        source_requests_total.inc(source=label, outcome=outcome)
+        raise SourceUnavailable(f"{label}: {str(e) or type(e).__name__}") from e
+    
+    latency = timer.elapsed()
+    health.record_success(latency, probe)
+    source_latency.observe(latency, source=label)
+    source_requests_total.inc(source=label, outcome='ok')
+    return data
+
+# === CACHE WYNIKÓW ===
+DATA_DIR = os.environ.get('DATA_DIR', '.')
+CACHE_DB_PATH = os.environ.get('CACHE_DB_PATH', os.path.join(DATA_DIR, 'cache.sqlite3'))
+CACHE_MEMORY_SIZE = int(os.environ.get('CACHE_MEMORY_SIZE', 2000))
+
+# Czas ważności wyników per źródło (sekundy); źródła lokalne nie są cache'owane
+SOURCE_TTLS = {
+    'Google Business': float(os.environ.get('TTL_GOOGLE', 6 * 3600)),
+    'International Registry': float(os.environ.get('TTL_INTERNATIONAL', 24 * 3600)),
+    'Business News': float(os.environ.get('TTL_NEWS', 24 * 3600)),
+}
+# Jak długo po wygaśnięciu wolno oddać stary wynik, odświeżając go w tle
+CACHE_STALE_TTL = float(os.environ.get('CACHE_STALE_TTL', 24 * 3600))
+# Krótszy czas życia dla braku wyników (negative cache)
+CACHE_NEGATIVE_TTL = float(os.environ.get('CACHE_NEGATIVE_TTL', 15 * 60))
+
+NIP_FORMAT_PATTERN = re.compile(r'\b\d{3}[- ]\d{3}[- ]\d{2}[- ]\d{2}\b|\b\d{3}[- ]\d{2}[- ]\d{2}[- ]\d{3}\b')
+
+def canonical_query(query):
+    """Ujednolić zapytanie: pojedyncze spacje, NIP jako same cyfry"""
+    collapsed = ' '.join(query.split())
+    return NIP_FORMAT_PATTERN.sub(lambda match: re.sub(r'\D', '', match.group()), collapsed)
+
+def normalize_query(query):
+    """Klucz cache: zapytanie kanoniczne bez rozróżniania wielkości liter"""
+    return canonical_query(query).casefold()
+
+class ResultCache:
+    """Dwupoziomowy cache wyników źródeł: LRU w pamięci + SQLite na dysku"""
+    
+    def __init__(self, path, max_items):
+        self.path = path
+        self.max_items = max_items
+        self._memory = OrderedDict()
+        self._db = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS result_cache ('
+                'source TEXT, query TEXT, data TEXT, expires_at REAL, stale_until REAL, '
+                'PRIMARY KEY (source, query))'
+            )
+            self._db.execute('DELETE FROM result_cache WHERE stale_until < ?', (time.time(),))
+            self._db.commit()
+        return self._db
+    
+    def _db_get(self, key):
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    'SELECT data, expires_at, stale_until FROM result_cache WHERE source = ? AND query = ?', key
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Błąd cache (odczyt): {e}")
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+    
+    def _db_set(self, key, entry):
+        data, expires_at, stale_until = entry
+        try:
+            with self._lock:
+                db = self._connect()
+                db.execute(
+                    'INSERT OR REPLACE INTO result_cache VALUES (?, ?, ?, ?, ?)',
+                    (*key, json.dumps(data, ensure_ascii=False), expires_at, stale_until)
+                )
+                db.commit()
+        except sqlite3.Error as e:
+            print(f"Błąd cache (zapis): {e}")
+    
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+    
+    async def get(self, source, query):
+        """Zwróć (dane, czy_świeże) albo None, gdy brak wpisu"""
+        key = (source, query)
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = await asyncio.to_thread(self._db_get, key)
+            if entry is not None:
+                self._remember(key, entry)
+        else:
+            self._memory.move_to_end(key)
+        
+        now = time.time()
+        if entry is None or now > entry[2]:
+            self._memory.pop(key, None)
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        data, expires_at, _ = entry
+        return data, now <= expires_at
+    
+    async def set(self, source, query, data):
+        """Zapisz wynik źródła (None = potwierdzony brak wyników: CACHE_NEGATIVE_TTL bez okna stale)"""
+        now = time.time()
+        if data is None:
+            expires_at = stale_until = now + CACHE_NEGATIVE_TTL
+        else:
+            expires_at = now + SOURCE_TTLS[source]
+            stale_until = expires_at + CACHE_STALE_TTL
+        entry = (data, expires_at, stale_until)
+        self._remember((source, query), entry)
+        await asyncio.to_thread(self._db_set, (source, query), entry)
+
+result_cache = ResultCache(CACHE_DB_PATH, CACHE_MEMORY_SIZE)
+_revalidations = {}
+
+def schedule_revalidation(label, search_func, query, cache_key):
+    """Odśwież przeterminowany wpis w tle (stale-while-revalidate)"""
+    key = (label, cache_key)
+    if key in _revalidations:
+        return
+    
+    async def revalidate():
+        search_priority.set(PRIORITY_BACKGROUND)
+        try:
+            data = await fetch_source(label, search_func, query)
+            await result_cache.set(label, cache_key, data)
+            print(f"♻️ Odświeżono cache: {label} / {cache_key}")
+        except Exception as e:
+            print(f"Błąd odświeżania cache {label}: {e}")
+        finally:
+            _revalidations.pop(key, None)
+    
+    _revalidations[key] = asyncio.create_task(revalidate())
+
+# === CACHE HTTP (ETag / Last-Modified) ===
+# Odpowiedzi JSON (Wikipedia, OpenCorporates) trzymamy razem z walidatorami;
+# po wygaśnięciu pytamy warunkowo (If-None-Match / If-Modified-Since) i przy
+# 304 używamy zapisanej treści zamiast pobierać ją ponownie
+HTTP_CACHE_PATH = os.environ.get('HTTP_CACHE_PATH', os.path.join(DATA_DIR, 'http_cache.sqlite3'))
+HTTP_CACHE_MAX_BYTES = int(os.environ.get('HTTP_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+# Nagłówki odpowiedzi zapisywane w cache (treść jest już zdekodowana)
+HTTP_CACHE_HEADERS = ('content-type', 'etag', 'last-modified', 'cache-control')
+MAX_AGE_PATTERN = re.compile(r'(?:^|,)\s*max-age\s*=\s*"?(\d+)', re.IGNORECASE)
+
+def parse_cache_control(value):
+    """Zwróć (czy_zapisywać, max-age w sekundach) wg nagłówka Cache-Control"""
+    directives = {directive.strip().split('=', 1)[0].lower() for directive in value.split(',')}
+    if 'no-store' in directives:
+        return False, 0
+    if 'no-cache' in directives:
+        return True, 0
+    match = MAX_AGE_PATTERN.search(value)
+    return True, int(match.group(1)) if match else 0
+
+class HttpCache:
+    """Cache odpowiedzi HTTP w SQLite, ograniczony rozmiarem (usuwa najdawniej używane)"""
+    
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.total_bytes = None
+        self._db = None
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS http_cache ('
+                'url TEXT PRIMARY KEY, headers TEXT, body BLOB, size INTEGER, '
+                'etag TEXT, last_modified TEXT, expires_at REAL, last_used REAL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS http_cache_last_used ON http_cache (last_used)')
+            self.total_bytes = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM http_cache').fetchone()[0]
+        return self._db
+    
+    def get(self, url):
+        """Zwróć (nagłówki, treść, etag, last_modified, ważne do) albo None"""
+        try:
+            with self._lock:
+                db = self._connect()
+                row = db.execute(
+                    'SELECT headers, body, etag, last_modified, expires_at FROM http_cache WHERE url = ?', (url,)
+                ).fetchone()
+                if row is not None:
+                    db.execute('UPDATE http_cache SET last_used = ? WHERE url = ?', (time.time(), url))
+                    db.commit()
+        except sqlite3.Error as e:
+            print(f"Błąd cache HTTP (odczyt): {e}")
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2], row[3], row[4]
+    
+    def set(self, url, headers, body, etag, last_modified, expires_at):
+        try:
+            with self._lock:
+                db = self._connect()
+                old = db.execute('SELECT size FROM http_cache WHERE url = ?', (url,)).fetchone()
+                db.execute(
+                    'INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (url, json.dumps(headers), body, len(body), etag, last_modified, expires_at, time.time())
+                )
+                self.total_bytes += len(body) - (old[0] if old else 0)
+                
+                # Limit na dysku: usuwaj najdawniej używane wpisy
+                while self.total_bytes > self.max_bytes:
+                    oldest = db.execute(
+                        'SELECT url, size FROM http_cache ORDER BY last_used LIMIT 1'
+                    ).fetchone()
+                    if oldest is None:
+                        break
+                    db.execute('DELETE FROM http_cache WHERE url = ?', (oldest[0],))
+                    self.total_bytes -= oldest[1]
+                db.commit()
+        except sqlite3.Error as e:
+            print(f"Błąd cache HTTP (zapis): {e}")
+    
+    def refresh(self, url, expires_at):
+        """Po 304: wpis znów ważny do `expires_at`"""
+        try:
+            with self._lock:
+                db = self._connect()
+                db.execute(
+                    'UPDATE http_cache SET expires_at = ?, last_used = ? WHERE url = ?', (expires_at, time.time(), url)
+                )
+                db.commit()
+        except sqlite3.Error as e:
+            print(f"Błąd cache HTTP (zapis): {e}")
+    
+    def delete(self, url):
+        try:
+            with self._lock:
+                db = self._connect()
+                old = db.execute('SELECT size FROM http_cache WHERE url = ?', (url,)).fetchone()
+                if old is not None:
+                    db.execute('DELETE FROM http_cache WHERE url = ?', (url,))
+                    db.commit()
+                    self.total_bytes -= old[0]
+        except sqlite3.Error as e:
+            print(f"Błąd cache HTTP (zapis): {e}")
+
+http_cache = HttpCache(HTTP_CACHE_PATH, HTTP_CACHE_MAX_BYTES)
+
+def cached_response(url, headers, body):
+    """Odpowiedź 200 zbudowana z wpisu cache (dla kodu źródła wygląda jak pobrana)"""
+    return httpx.Response(200, headers=headers, content=body, request=httpx.Request('GET', url))
+
+async def cached_http_get(url, params=None, headers=None, timeout=10):
+    """http_get z cache HTTP: świeży wpis bez sieci, przeterminowany - zapytanie warunkowe"""
+    url = str(httpx.URL(url, params=params))
+    entry = await asyncio.to_thread(http_cache.get, url)
+    
+    request_headers = dict(headers or {})
+    if entry is not None:
+        cached_headers, body, etag, last_modified, expires_at = entry
+        if time.time() < expires_at:
+            http_cache_requests_total.inc(result='hit')
+            return cached_response(url, cached_headers, body)
+        if etag:
+            request_headers['If-None-Match'] = etag
+        if last_modified:
+            request_headers['If-Modified-Since'] = last_modified
+    
+    response = await http_get(url, headers=request_headers, timeout=timeout)
+    store, max_age = parse_cache_control(response.headers.get('cache-control', ''))
+    
+    if response.status_code == 304 and entry is not None:
+        http_cache_requests_total.inc(result='revalidated')
+        await asyncio.to_thread(http_cache.refresh, url, time.time() + max_age)
+        return cached_response(url, cached_headers, body)
+    
+    if response.status_code != 200:
+        http_cache_requests_total.inc(result='uncacheable')
+        return response
+    
+    etag = response.headers.get('etag')
+    last_modified = response.headers.get('last-modified')
+    if store and (max_age or etag or last_modified):
+        http_cache_requests_total.inc(result='miss')
+        stored_headers = {name: response.headers[name] for name in HTTP_CACHE_HEADERS if name in response.headers}
+        await asyncio.to_thread(
+            http_cache.set, url, stored_headers, response.content, etag, last_modified, time.time() + max_age
+        )
+    else:
+        http_cache_requests_total.inc(result='uncacheable')
+        if entry is not None:
+            await asyncio.to_thread(http_cache.delete, url)
+    return response
+
+# === INDEKS NIP ===
+# Lokalny indeks NIP budowany ze zrzutów KRS/CEIDG (CSV) - zapytanie o NIP bez sieci
+NIP_INDEX_PATH = os.environ.get('NIP_INDEX_PATH', os.path.join(DATA_DIR, 'nip_index.sqlite3'))
+NIP_DUMP_PATH = os.environ.get('NIP_DUMP_PATH')
+NIP_REFRESH_INTERVAL = float(os.environ.get('NIP_REFRESH_INTERVAL', 6 * 3600))
+NIP_IMPORT_BATCH = 10000
+
+NIP_WEIGHTS = (6, 5, 7, 2, 3, 4, 5, 6, 7)
+# Zapytanie, które jest samym numerem NIP (po canonical_query)
+NIP_QUERY_PATTERN = re.compile(r'^(?:nip\s*:?\s*)?(\d{10})$', re.IGNORECASE)
+
+# Nazwy kolumn spotykane w zrzutach rejestrów -> pole wyniku
+NIP_DUMP_COLUMNS = {
+    'nip': ('nip',),
+    'nazwa_firmy': ('nazwa_firmy', 'nazwa', 'firma', 'nazwa_przedsiebiorcy', 'name'),
+    'imie_nazwisko': ('imie_nazwisko', 'wlasciciel', 'właściciel', 'reprezentant', 'owner'),
+    'imie': ('imie', 'imię', 'first_name'),
+    'nazwisko': ('nazwisko', 'last_name'),
+    'adres': ('adres', 'adres_siedziby', 'address'),
+    'ulica': ('ulica', 'street'),
+    'budynek': ('budynek', 'nr_domu', 'numer'),
+    'kod_pocztowy': ('kod_pocztowy', 'kod', 'postal_code'),
+    'miejscowosc': ('miejscowosc', 'miejscowość', 'miasto', 'city'),
+}
+
+def is_valid_nip(nip):
+    """Sprawdź sumę kontrolną NIP (10 cyfr, wagi 6-5-7-2-3-4-5-6-7, modulo 11)"""
+    if len(nip) != 10 or not nip.isdigit():
+        return False
+    checksum = sum(int(digit) * weight for digit, weight in zip(nip, NIP_WEIGHTS)) % 11
+    return checksum != 10 and checksum == int(nip[9])
+
+def _dump_row_to_record(row, columns):
+    """Zamień wiersz CSV na (nip, nazwa, osoba, adres) albo None dla złego NIP"""
+    def value(field):
+        column = columns.get(field)
+        return (row.get(column) or '').strip() if column else ''
+    
+    nip = re.sub(r'\D', '', value('nip'))
+    if not is_valid_nip(nip):
+        return None
+    
+    person = value('imie_nazwisko') or ' '.join(filter(None, (value('imie'), value('nazwisko'))))
+    address = value('adres')
+    if not address:
+        street = ' '.join(filter(None, (value('ulica'), value('budynek'))))
+        city = ' '.join(filter(None, (value('kod_pocztowy'), value('miejscowosc'))))
+        address = ', '.join(filter(None, (street, city)))
+    
+    return (
+        int(nip),
+        value('nazwa_firmy') or 'Brak danych',
+        person or 'Brak danych',
+        format_address(address),
+    )
+
+class NipIndex:
+    """Indeks NIP w SQLite: NIP jako klucz rowid (zwarte B-drzewo, wyszukiwanie w mikrosekundach)"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._reader = None
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS nip_index ('
+            'nip INTEGER PRIMARY KEY, nazwa_firmy TEXT, imie_nazwisko TEXT, adres TEXT)'
+        )
+        db.execute('CREATE TABLE IF NOT EXISTS nip_index_meta (key TEXT PRIMARY KEY, value TEXT)')
+        return db
+    
+    def lookup(self, nip):
+        """Dane firmy dla poprawnego NIP albo None, gdy brak w indeksie"""
+        with self._lock:
+            if self._reader is None:
+                self._reader = self._connect()
+            row = self._reader.execute(
+                'SELECT nazwa_firmy, imie_nazwisko, adres FROM nip_index WHERE nip = ?', (int(nip),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'nazwa_firmy': row[0], 'imie_nazwisko': row[1], 'adres': row[2], 'nip': nip}
+    
+    def import_dump(self, dump_path):
+        """Wczytaj zrzut CSV przyrostowo: nadpisywane są tylko nowe lub zmienione wiersze.
+        
+        Zrzut to pełny stan rejestru - NIP-y, których w nim nie ma (firmy
+        wykreślone), są na końcu usuwane z indeksu. Działa na własnym
+        połączeniu (wątek w tle albo CLI) i zatwierdza małe paczki, więc bot
+        może w tym czasie normalnie czytać indeks.
+        """
+        stat = os.stat(dump_path)
+        signature = f'{stat.st_size}:{stat.st_mtime_ns}'
+        db = self._connect()
+        try:
+            previous = db.execute(
+                'SELECT value FROM nip_index_meta WHERE key = ?', (f'dump:{os.path.abspath(dump_path)}',)
+            ).fetchone()
+            if previous and previous[0] == signature:
+                print(f"📇 Indeks NIP aktualny ({dump_path})")
+                return 0, 0
+            
+            started = time.perf_counter()
+            total = changed = invalid = 0
+            db.execute('CREATE TEMP TABLE IF NOT EXISTS import_seen (nip INTEGER PRIMARY KEY)')
+            db.execute('DELETE FROM import_seen')
+            with open(dump_path, newline='', encoding='utf-8-sig') as f:
+                dialect = csv.Sniffer().sniff(f.read(64 * 1024), delimiters=',;\t|')
+                f.seek(0)
+                reader = csv.DictReader(f, dialect=dialect)
+                headers = {(name or '').strip().lower(): name for name in reader.fieldnames or []}
+                columns = {
+                    field: next((headers[alias] for alias in aliases if alias in headers), None)
+                    for field, aliases in NIP_DUMP_COLUMNS.items()
+                }
+                if columns['nip'] is None:
+                    raise ValueError(f"Brak kolumny NIP w {dump_path}")
+                
+                batch = []
+                for row in reader:
+                    record = _dump_row_to_record(row, columns)
+                    if record is None:
+                        invalid += 1
+                        continue
+                    batch.append(record)
+                    if len(batch) >= NIP_IMPORT_BATCH:
+                        changed += self._upsert(db, batch)
+                        total += len(batch)
+                        batch = []
+                if batch:
+                    changed += self._upsert(db, batch)
+                    total += len(batch)
+            
+            # Pusty zrzut to raczej uszkodzony plik niż rejestr bez firm - nic nie usuwamy
+            removed = 0
+            if total:
+                removed = db.execute('DELETE FROM nip_index WHERE nip NOT IN (SELECT nip FROM import_seen)').rowcount
+            db.execute(
+                'INSERT OR REPLACE INTO nip_index_meta VALUES (?, ?)',
+                (f'dump:{os.path.abspath(dump_path)}', signature)
+            )
+            db.commit()
+            print(
+                f"📇 Indeks NIP: {total} wierszy, {changed} nowych/zmienionych, {removed} usuniętych, "
+                f"{invalid} z błędnym NIP ({time.perf_counter() - started:.1f}s)"
+            )
+            return total, changed
+        finally:
+            db.close()
+    
+    def _upsert(self, db, batch):
+        db.executemany('INSERT OR IGNORE INTO import_seen VALUES (?)', [(record[0],) for record in batch])
+        before = db.total_changes
+        db.executemany(
+            'INSERT INTO nip_index VALUES (?, ?, ?, ?) ON CONFLICT(nip) DO UPDATE SET '
+            'nazwa_firmy = excluded.nazwa_firmy, imie_nazwisko = excluded.imie_nazwisko, adres = excluded.adres '
+            'WHERE (nazwa_firmy, imie_nazwisko, adres) IS NOT (excluded.nazwa_firmy, excluded.imie_nazwisko, excluded.adres)',
+            batch
+        )
+        db.commit()
+        return db.total_changes - before
+
+nip_index = NipIndex(NIP_INDEX_PATH)
+
+async def refresh_nip_index():
+    """Okresowo dociągaj zmiany ze zrzutu NIP_DUMP_PATH w wątku w tle"""
+    while True:
+        try:
+            await asyncio.to_thread(nip_index.import_dump, NIP_DUMP_PATH)
+        except (OSError, ValueError, csv.Error, sqlite3.Error) as e:
+            print(f"❌ Błąd importu indeksu NIP: {e}")
+        await asyncio.sleep(NIP_REFRESH_INTERVAL)
+
+# === INDEKS NAZW FIRM ===
+# Rozwiązane wcześniej firmy (nazwa kanoniczna + zapytania, które do niej prowadziły)
+# z indeksem trigramów: literówki i częściowe nazwy dostają odpowiedź od razu,
+# a tryb inline podpowiada firmy w trakcie pisania. Dane leżą w SQLite, w pamięci
+# jest tylko ograniczony cache stron, więc miliony wpisów nie rosną w RAM.
+NAME_INDEX_PATH = os.environ.get('NAME_INDEX_PATH', os.path.join(DATA_DIR, 'name_index.sqlite3'))
+NAME_INDEX_MAX_ENTRIES = int(os.environ.get('NAME_INDEX_MAX_ENTRIES', 2_000_000))
+NAME_INDEX_CACHE_KB = int(os.environ.get('NAME_INDEX_CACHE_KB', 8192))
+# Minimalne podobieństwo trigramów (Dice), by podpowiedzieć znaną firmę
+NAME_SUGGEST_THRESHOLD = float(os.environ.get('NAME_SUGGEST_THRESHOLD', 0.35))
+# Najkrótsze słowo, w którym literówka jeszcze nie zmienia firmy ("lot" vs "lod")
+NAME_TYPO_MIN_LENGTH = 4
+# Ile kandydatów z indeksu trigramów oceniamy dokładnie
+NAME_FUZZY_CANDIDATES = 50
+# Ile wpisów list trigramów najwyżej przeglądamy (częste trigramy, np. " sp", są pomijane)
+NAME_FUZZY_POSTINGS = 20000
+NUMBER_PATTERN = re.compile(r'\d+')
+
+def name_trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def trigram_similarity(a, b):
+    """Współczynnik Dice'a zbiorów trigramów (0..1)"""
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+def edit_distance(a, b):
+    """Odległość edycyjna z przestawieniem sąsiednich znaków (OSA)"""
+    before_previous, previous = None, list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                distance = min(distance, before_previous[j - 2] + 1)
+            current.append(distance)
+        before_previous, previous = previous, current
+    return previous[-1]
+
+def is_typo_of(key, candidate):
+    """Czy klucz to nazwa kandydata z jedną literówką: te same słowa poza jednym, różnym o jedną edycję"""
+    words, candidate_words = key.split(), candidate.split()
+    if len(words) != len(candidate_words):
+        return False
+    differing = [(word, other) for word, other in zip(words, candidate_words) if word != other]
+    if len(differing) != 1:
+        return False
+    word, other = differing[0]
+    return (
+        min(len(word), len(other)) >= NAME_TYPO_MIN_LENGTH
+        # Liczby w nazwie muszą się zgadzać ("Firma 12" to nie "Firma 13")
+        and NUMBER_PATTERN.findall(word) == NUMBER_PATTERN.findall(other)
+        and edit_distance(word, other) == 1
+    )
+
+def index_entry_fresh(data, updated_at):
+    """Wpis indeksu nazw jest świeży, dopóki świeże byłyby wyniki źródeł, z których powstał"""
+    labels = [label for label in data.get('źródło', '').split(', ') if label in SOURCE_TTLS]
+    ttl = min((SOURCE_TTLS[label] for label in labels), default=min(SOURCE_TTLS.values()))
+    return time.time() - updated_at <= ttl
+
+class NameIndex:
+    """Indeks nazw firm w SQLite: dokładne, prefiksowe i rozmyte (trigramy) dopasowanie zapytań"""
+    
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = None
+        self._db = None
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(f'PRAGMA cache_size=-{NAME_INDEX_CACHE_KB}')
+            # key = znormalizowana nazwa albo zapytanie; canonical = klucz nazwy firmy
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS company_names ('
+                'key TEXT PRIMARY KEY, canonical TEXT, data TEXT, updated_at REAL) WITHOUT ROWID'
+            )
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS name_trigrams ('
+                'trigram TEXT, key TEXT, PRIMARY KEY (trigram, key)) WITHOUT ROWID'
+            )
+            # Liczba kluczy z danym trigramem - rozmyte szukanie zaczyna od najrzadszych
+            self._db.execute('CREATE TABLE IF NOT EXISTS trigram_counts (trigram TEXT PRIMARY KEY, n INTEGER) WITHOUT ROWID')
+            self._db.execute('CREATE INDEX IF NOT EXISTS company_names_updated ON company_names (updated_at)')
+            self.entries = self._db.execute('SELECT COUNT(*) FROM company_names').fetchone()[0]
+        return self._db
+    
+    def _insert(self, db, key, canonical, data, now):
+        exists = db.execute('SELECT 1 FROM company_names WHERE key = ?', (key,)).fetchone()
+        db.execute('INSERT OR REPLACE INTO company_names VALUES (?, ?, ?, ?)', (key, canonical, data, now))
+        if not exists:
+            trigrams = [(trigram,) for trigram in name_trigrams(key)]
+            db.executemany('INSERT OR IGNORE INTO name_trigrams VALUES (?, ?)', [(trigram, key) for (trigram,) in trigrams])
+            db.executemany(
+                'INSERT INTO trigram_counts VALUES (?, 1) ON CONFLICT (trigram) DO UPDATE SET n = n + 1', trigrams
+            )
+            self.entries += 1
+    
+    def _prune(self, db):
+        """Usuń najdawniej odświeżane wpisy ponad limit (z zapasem 10%, żeby nie robić tego co chwilę)"""
+        excess = self.entries - int(self.max_entries * 0.9)
+        rows = db.execute('SELECT key FROM company_names ORDER BY updated_at LIMIT ?', (excess,)).fetchall()
+        for (key,) in rows:
+            trigrams = [(trigram,) for trigram in name_trigrams(key)]
+            db.execute('DELETE FROM company_names WHERE key = ?', (key,))
+            db.executemany('DELETE FROM name_trigrams WHERE trigram = ? AND key = ?', [(trigram, key) for (trigram,) in trigrams])
+            db.executemany('UPDATE trigram_counts SET n = n - 1 WHERE trigram = ?', trigrams)
+        self.entries -= len(rows)
+    
+    def add(self, query, results):
+        """Zapamiętaj rozwiązaną firmę pod jej nazwą i pod zapytaniem, które do niej prowadziło"""
+        canonical = normalize_query(results['nazwa_firmy'])
+        if not canonical:
+            return
+        data = json.dumps(results, ensure_ascii=False)
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._connect()
+                for key in dict.fromkeys((canonical, normalize_query(query))):
+                    self._insert(db, key, canonical, data, now)
+                if self.entries > self.max_entries:
+                    self._prune(db)
+                db.commit()
+        except sqlite3.Error as e:
+            print(f"Błąd indeksu nazw (zapis): {e}")
+    
+    def _rows(self, db, keys):
+        """Wpisy dla kluczy, w kolejności kluczy, po jednym na firmę"""
+        found = {}
+        for key in keys:
+            row = db.execute('SELECT canonical, data, updated_at FROM company_names WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[0] not in found:
+                found[row[0]] = (json.loads(row[1]), row[2])
+        return list(found.values())
+    
+    def _fuzzy(self, db, key):
+        """Klucze najbardziej podobne do `key`: [(podobieństwo, klucz)] malejąco"""
+        trigrams = name_trigrams(key)
+        counts = dict(db.execute(
+            f'SELECT trigram, n FROM trigram_counts WHERE trigram IN ({",".join("?" * len(trigrams))}) AND n > 0',
+            tuple(trigrams)
+        ).fetchall())
+        
+        # Najrzadsze trigramy w ramach budżetu wpisów (zawsze co najmniej jeden)
+        selected, postings = [], 0
+        for trigram, n in sorted(counts.items(), key=lambda item: item[1]):
+            if selected and postings + n > NAME_FUZZY_POSTINGS:
+                break
+            selected.append(trigram)
+            postings += n
+        if not selected:
+            return []
+        
+        candidates = db.execute(
+            f'SELECT key FROM name_trigrams WHERE trigram IN ({",".join("?" * len(selected))}) '
+            'GROUP BY key ORDER BY COUNT(*) DESC LIMIT ?',
+            (*selected, NAME_FUZZY_CANDIDATES)
+        ).fetchall()
+        scored = [(trigram_similarity(trigrams, name_trigrams(candidate)), candidate) for (candidate,) in candidates]
+        return sorted(scored, reverse=True)
+    
+    def match(self, query):
+        """Świeże dane firmy, jeśli zapytanie to znana firma, inaczej None.
+        
+        Odpowiedzią jest tylko dokładny klucz albo ta sama nazwa z jedną
+        literówką; luźniej podobne firmy trafiają wyłącznie do podpowiedzi.
+        """
+        key = normalize_query(query)
+        if not key:
+            return None
+        try:
+            with self._lock:
+                db = self._connect()
+                rows = self._rows(db, [key])
+                if not rows:
+                    keys = [candidate for _, candidate in self._fuzzy(db, key) if is_typo_of(key, candidate)][:1]
+                    rows = self._rows(db, keys)
+        except sqlite3.Error as e:
+            print(f"Błąd indeksu nazw (odczyt): {e}")
+            return None
+        # Przeterminowany wpis: wyszukiwanie na żywo, gdzie cache źródeł obsłuży stale-while-revalidate
+        if not rows or not index_entry_fresh(*rows[0]):
+            return None
+        return rows[0][0]
+    
+    def suggest(self, query, limit=5):
+        """Podpowiedzi [(dane, czy_prefiks)]: najpierw nazwy zaczynające się od zapytania, potem podobne"""
+        key = normalize_query(query)
+        if not key:
+            return []
+        try:
+            with self._lock:
+                db = self._connect()
+                prefixed = db.execute(
+                    'SELECT key FROM company_names WHERE key >= ? AND key < ? ORDER BY key LIMIT ?',
+                    (key, key + '\U0010ffff', limit)
+                ).fetchall()
+                prefixed_rows = self._rows(db, [row[0] for row in prefixed])
+                similar_rows = self._rows(db, [
+                    candidate for similarity, candidate in self._fuzzy(db, key)
+                    if similarity >= NAME_SUGGEST_THRESHOLD
+                ])
+        except sqlite3.Error as e:
+            print(f"Błąd indeksu nazw (odczyt): {e}")
+            return []
+        seen = set()
+        suggestions = []
+        for rows, is_prefix in ((prefixed_rows, True), (similar_rows, False)):
+            for data, _ in rows:
+                name = normalize_query(data['nazwa_firmy'])
+                if name not in seen:
+                    seen.add(name)
+                    suggestions.append((data, is_prefix))
+        return suggestions[:limit]
+
+name_index = NameIndex(NAME_INDEX_PATH, NAME_INDEX_MAX_ENTRIES)
+
 # === LIVE WEB SCRAPING ===
-async def live_business_search(query):
-    """Przeszukaj internet na żywo w poszukiwaniu danych firmy"""
-    print(f"🔍 LIVE SEARCH: {query}")
+# Maksymalne limity czasu źródeł (faktyczny limit dobiera SourceHealth z p95) i budżet całego zapytania (sekundy)
+SOURCE_DEADLINES = {
+    'KRS/CEIDG': float(os.environ.get('DEADLINE_KRS', 10)),
+    'Google Business': float(os.environ.get('DEADLINE_GOOGLE', 15)),
+    'International Registry': float(os.environ.get('DEADLINE_INTERNATIONAL', 10)),
+    'Business News': float(os.environ.get('DEADLINE_NEWS', 10)),
+}
+SEARCH_BUDGET = float(os.environ.get('SEARCH_BUDGET', 20))
+# Budżet wyszukiwań w tle (/batch): przy ruchu użytkowników czekają w kolejce hostów
+# za zapytaniami interaktywnymi i w SEARCH_BUDGET skończyłyby jako "Brak danych"
+SEARCH_BUDGET_BACKGROUND = float(os.environ.get('SEARCH_BUDGET_BACKGROUND', 180))
+
+# Adresy źródeł (nadpisywane np. przez benchmarks/loadtest.py na lokalne atrapy)
+DUCKDUCKGO_URL = os.environ.get('DUCKDUCKGO_URL', 'https://html.duckduckgo.com/html/')
+OPENCORPORATES_URL = os.environ.get('OPENCORPORATES_URL', 'https://api.opencorporates.com/v0.4/companies/search')
+WIKIPEDIA_URL = os.environ.get('WIKIPEDIA_URL', 'https://en.wikipedia.org/api/rest_v1/page/summary/')
+
+source_health = {label: SourceHealth(label, deadline) for label, deadline in SOURCE_DEADLINES.items()}
+
+def get_search_sources(query):
+    """Zwróć źródła do przeszukania w stałej kolejności scalania (kolejność = priorytet)"""
+    sources = []
+    
+    # 1. Sprawdź czy to polskie NIP
+    if re.search(r'\d{10}', query):
+        sources.append(('KRS/CEIDG', search_polish_registry))
+    
+    # 2. Google Business, 3. rejestry międzynarodowe, 4. źródła informacyjne
+    sources.append(('Google Business', search_google_business))
+    sources.append(('International Registry', search_international_registry))
+    sources.append(('Business News', search_business_news))
+    return sources
+
+async def run_source(label, search_func, query, cache_key):
+    """Uruchom jedno źródło (najpierw sprawdź cache); błąd źródła = brak danych"""
+    if label not in SOURCE_TTLS:
+        # Źródło lokalne (indeks NIP) - szybsze niż cache i zawsze aktualne
+        try:
+            return await fetch_source(label, search_func, query)
+        except SourceUnavailable as e:
+            print(f"⚠️ {e}")
+            return None
+    
+    cached = await result_cache.get(label, cache_key)
+    if cached is not None:
+        data, is_fresh = cached
+        source_requests_total.inc(source=label, outcome='cached' if is_fresh else 'stale')
+        if not is_fresh:
+            schedule_revalidation(label, search_func, query, cache_key)
+        return data
+    
+    try:
+        data = await fetch_source(label, search_func, query)
+    except SourceUnavailable as e:
+        print(f"⚠️ {e}")
+        return None
+    
+    await result_cache.set(label, cache_key, data)
+    return data
+
+# Ocena pewności pól: wiarygodność źródła x jakość dopasowania wartości (0..1)
+SOURCE_RELIABILITY = {
+    'KRS/CEIDG': 1.0,
+    'International Registry': 0.85,
+    'Business News': 0.7,
+    'Google Business': 0.6,
+}
+# Pole o pewności od tego progu jest rozstrzygnięte (patrz fields_settled)
+CONFIDENCE_THRESHOLD = float(os.environ.get('CONFIDENCE_THRESHOLD', 0.8))
+# Kończ wcześniej, gdy żadne źródło nie może już uczynić pola pewnym, nawet
+# jeśli mogłoby je poprawić (domyślnie czekamy na każdą możliwą poprawę w budżecie)
+SETTLE_BELOW_THRESHOLD = os.environ.get('SETTLE_BELOW_THRESHOLD', '0') == '1'
+# Pola, które źródło w ogóle potrafi dostarczyć (brak wpisu = wszystkie);
+# OpenCorporates nie podaje osób
+SOURCE_FIELDS = {
+    'International Registry': ('nazwa_firmy', 'adres', 'nip'),
+}
+# Najwyższa możliwa jakość dopasowania pola (osoba z tekstu nigdy nie jest pewna w 100%)
+MAX_MATCH_QUALITY = {'nazwa_firmy': 1.0, 'adres': 1.0, 'imie_nazwisko': 0.8, 'nip': 1.0}
+
+def match_quality(field, value, query):
+    """Jak bardzo wartość wygląda na prawdziwe dane, a nie na zgadywanie (0..1)"""
+    if not value or value == 'Brak danych':
+        return 0.0
+    guessed = normalize_query(value) == normalize_query(query)
+    if field == 'nazwa_firmy':
+        if COMPANY_SUFFIX_PATTERN.search(value):
+            return 1.0
+        # Samo zapytanie (query.title()) to tylko zgadywanie
+        return 0.3 if guessed else 0.8
+    if field == 'imie_nazwisko':
+        return 0.2 if guessed else 0.8
+    if field == 'nip':
+        digits = re.sub(r'\D', '', value)
+        if len(digits) == 10 and is_valid_nip(digits):
+            return 1.0
+        return 0.7
+    if field == 'adres':
+        return 1.0 if any(pattern.search(value) for pattern in ADDRESS_PATTERNS) else 0.7
+    return 0.5
+
+def best_possible_score(label, field):
+    """Najwyższa pewność, jaką źródło może dać polu"""
+    if field not in SOURCE_FIELDS.get(label, RESULT_FIELDS):
+        return 0.0
+    return SOURCE_RELIABILITY.get(label, 0.5) * MAX_MATCH_QUALITY[field]
+
+def fields_settled(confidence, pending_labels):
+    """Czy czekanie na pozostałe źródła nie może już niczego poprawić.
     
-    # Wyniki z różnych źródeł
-    results = {
+    Pole jest rozstrzygnięte, gdy jest pewne (CONFIDENCE_THRESHOLD) albo gdy
+    żadne z pozostałych źródeł nie może podnieść jego pewności. W praktyce
+    zapytanie o NIP kończy się po trafieniu w KRS/CEIDG (wszystkie pola pewne).
+    Z SETTLE_BELOW_THRESHOLD=1 czekamy tylko na źródła, które mogą uczynić pole
+    pewnym (albo wypełnić puste) - szybciej, ale np. adres z Wikipedii (0.49)
+    nie zostanie już zastąpiony lepszym z DuckDuckGo (do 0.6).
+    """
+    for field, score in confidence.items():
+        if score >= CONFIDENCE_THRESHOLD:
+            continue
+        for label in pending_labels:
+            best = best_possible_score(label, field)
+            if SETTLE_BELOW_THRESHOLD:
+                if best >= CONFIDENCE_THRESHOLD or (not score and best):
+                    return False
+            elif best > score:
+                return False
+    return True
+
+def merge_source_data(results, confidence, label, data, query):
+    """Dla każdego pola zachowaj wartość o najwyższej pewności (remis: wcześniejsze źródło)"""
+    reliability = SOURCE_RELIABILITY.get(label, 0.5)
+    for key in RESULT_FIELDS:
+        score = reliability * match_quality(key, data.get(key), query)
+        if score > confidence[key]:
+            results[key] = data[key]
+            confidence[key] = score
+    results['źródło'].append(label)
+
+def empty_results():
+    return {
         'nazwa_firmy': 'Brak danych',
         'imie_nazwisko': 'Brak danych',
         'adres': 'Brak danych', 
         'nip': 'Brak danych',
         'źródło': []
     }
+
+def merge_completed(tasks, query):
+    """Scal wyniki ukończonych źródeł w stałej kolejności źródeł, niezależnie od kolejności ukończenia.
+    
+    Zwraca (wyniki, pewność pól).
+    """
+    results = empty_results()
+    confidence = dict.fromkeys(RESULT_FIELDS, 0.0)
+    for label, task in tasks.items():
+        if task.done() and not task.cancelled() and task.exception() is None and task.result():
+            merge_source_data(results, confidence, label, task.result(), query)
+    
+    results['źródło'] = ', '.join(dict.fromkeys(results['źródło'])) if results['źródło'] else 'Brak źródeł'
+    return results, confidence
+
+async def live_business_search(query, user_id=None, on_progress=None):
+    """Przeszukaj internet na żywo w poszukiwaniu danych firmy.
+    
+    on_progress(wyniki_częściowe) jest wywoływane po każdym źródle, które
+    dostarczyło danych, dopóki pozostałe jeszcze trwają.
+    """
+    search_user.set(user_id)
+    query = canonical_query(query)
+    cache_key = normalize_query(query)
+    print(f"🔍 LIVE SEARCH: {query}")
     
+    # Błędny NIP odrzucamy przed jakimkolwiek zapytaniem do sieci
+    nip_query = NIP_QUERY_PATTERN.match(query)
+    if nip_query and not is_valid_nip(nip_query.group(1)):
+        print(f"❌ Nieprawidłowy NIP: {nip_query.group(1)}")
+        results = empty_results()
+        results.update({'nip': nip_query.group(1), 'źródło': 'Nieprawidłowy NIP (błędna suma kontrolna)'})
+        return results
+    
+    # Firma rozwiązana już wcześniej (także z jedną literówką w nazwie) - bez sieci
+    known = await asyncio.to_thread(name_index.match, query)
+    if known is not None:
+        print(f"📚 Znana firma z indeksu nazw: {known['nazwa_firmy']}")
+        return known
+    
+    tasks = {}
     try:
-        # 1. Sprawdź czy to polskie NIP
-        if re.search(r'\d{10}', query):
-            print("🇵🇱 Wyszukuję po NIP...")
-            polish_data = await search_polish_registry(query)
-            if polish_data:
-                results.update(polish_data)
-                results['źródło'].append('KRS/CEIDG')
-        
-        # 2. Wyszukaj w Google Business
-        print("🌐 Wyszukuję w Google...")
-        google_data = await search_google_business(query)
-        if google_data:
-            # Uzupełnij brakujące dane
-            for key, value in google_data.items():
-                if results[key] == 'Brak danych' and value != 'Brak danych':
-                    results[key] = value
-            results['źródło'].append('Google Business')
-        
-        # 3. Wyszukaj w rejestrach międzynarodowych
-        print("🌍 Wyszukuję międzynarodowo...")
-        intl_data = await search_international_registry(query)
-        if intl_data:
-            for key, value in intl_data.items():
-                if results[key] == 'Brak danych' and value != 'Brak danych':
-                    results[key] = value
-            results['źródło'].append('International Registry')
-        
-        # 4. Wyszukaj na stronach informacyjnych
-        print("📰 Wyszukuję w źródłach informacyjnych...")
-        news_data = await search_business_news(query)
-        if news_data:
-            for key, value in news_data.items():
-                if results[key] == 'Brak danych' and value != 'Brak danych':
-                    results[key] = value
-            results['źródło'].append('Business News')
+        # Wszystkie źródła startują równolegle
+        sources = get_search_sources(query)
+        print(f"🌐 Wyszukuję równolegle: {', '.join(label for label, _ in sources)}")
+        for label, search_func in sources:
+            tasks[label] = asyncio.create_task(run_source(label, search_func, query, cache_key))
+        
+        # Czekaj najwyżej budżet wyszukiwania - potem odpowiadamy tym, co już dotarło
+        budget = SEARCH_BUDGET if search_priority.get() == PRIORITY_INTERACTIVE else SEARCH_BUDGET_BACKGROUND
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + budget
+        pending = set(tasks.values())
+        while pending:
+            finished, pending = await asyncio.wait(
+                pending, timeout=max(0.0, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not finished:
+                break
+            if not pending or not any(task.exception() is None and task.result() for task in finished):
+                continue
             
-        results['źródło'] = ', '.join(set(results['źródło'])) if results['źródło'] else 'Brak źródeł'
+            partial, confidence = merge_completed(tasks, query)
+            skipped = [label for label, task in tasks.items() if task in pending]
+            if fields_settled(confidence, skipped):
+                # Pozostałe źródła nie poprawią żadnego pola - nie czekamy na nie
+                print(f"🎯 Pola rozstrzygnięte, anuluję: {', '.join(skipped)}")
+                for task in pending:
+                    task.cancel()
+                pending = set()
+                break
+            if on_progress is not None:
+                on_progress(partial)
+        
+        if pending:
+            skipped = [label for label, task in tasks.items() if task in pending]
+            print(f"⏱️ Budżet {budget}s wyczerpany, pomijam: {', '.join(skipped)}")
+        
+        with trace_stage('merge'):
+            results, confidence = merge_completed(tasks, query)
         print(f"✅ WYNIKI: {results}")
+        if confidence['nazwa_firmy'] >= CONFIDENCE_THRESHOLD:
+            await asyncio.to_thread(name_index.add, query, results)
         return results
         
     except Exception as e:
@@ -157,40 +1623,188 @@ async def live_business_search(query):
             'nip': 'Brak danych',
             'źródło': 'Błąd połączenia'
         }
+    finally:
+        for task in tasks.values():
+            task.cancel()
 
-async def search_polish_registry(query):
-    """Wyszukaj w polskich rejestrach (KRS/CEIDG)"""
+class InflightSearch:
+    """Wyszukiwanie w toku współdzielone przez identyczne zapytania, z rozsyłaniem postępu"""
+    
+    def __init__(self):
+        self.task = None
+        self.listeners = []
+        self.latest = None
+        self.waiters = 0
+    
+    def publish(self, partial):
+        self.latest = partial
+        for listener in list(self.listeners):
+            try:
+                listener(partial)
+            except Exception as e:
+                print(f"Błąd aktualizacji postępu: {e}")
+
+# Wyszukiwania w toku: ten sam (znormalizowany) klucz = jedno wspólne zadanie
+_inflight_searches = {}
+
+def _forget_inflight(key, inflight):
+    # Klucz mógł już zostać przejęty przez nowsze wyszukiwanie
+    if _inflight_searches.get(key) is inflight:
+        del _inflight_searches[key]
+
+async def shared_business_search(query, user_id=None, on_progress=None):
+    """Wyszukaj, dołączając do identycznego zapytania, które już trwa (single-flight).
+    
+    Gdy wszyscy oczekujący zrezygnują (anulowanie), wspólne wyszukiwanie
+    też jest anulowane, żeby nie obciążać źródeł na darmo.
+    """
+    # Osobno dla każdego priorytetu: wyszukiwanie z /batch ma dłuższy budżet i niższy
+    # priorytet w kolejkach, więc użytkownik nie może do niego dołączyć
+    key = (search_priority.get(), normalize_query(query))
+    inflight = _inflight_searches.get(key)
+    if inflight is None:
+        inflight = _inflight_searches[key] = InflightSearch()
+        inflight.task = asyncio.create_task(live_business_search(query, user_id, inflight.publish))
+        inflight.task.add_done_callback(lambda _: _forget_inflight(key, inflight))
+    else:
+        print(f"🔗 Dołączam do trwającego wyszukiwania: {key[1]}")
+        if on_progress is not None and inflight.latest is not None:
+            on_progress(inflight.latest)
+    
+    if on_progress is not None:
+        inflight.listeners.append(on_progress)
+    inflight.waiters += 1
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        # Sprawdź CEIDG (przedsiębiorcy indywidualni)
-        if 'przedsiębiorca' in query.lower() or re.search(r'\d{10}', query):
-            ceidg_url = "https://prod.ceidg.gov.pl/CEIDG/CEIDG.Public.UI/Search.aspx"
-            
-            # Symuluj wyszukiwanie CEIDG
-            session = requests.Session()
-            session.headers.update(headers)
-            
-            response = session.get(ceidg_url, timeout=10)
-            if response.status_code == 200:
-                # W prawdziwej implementacji parsowałbyś formularz CEIDG
-                # Tu zwracam przykładowe dane dla demonstracji
-                nip_match = re.search(r'\d{10}', query)
-                if nip_match:
-                    return {
-                        'nazwa_firmy': f'Firma dla NIP {nip_match.group()}',
-                        'imie_nazwisko': 'Jan Kowalski',
-                        'adres': 'ul. Przykładowa 1, 00-001 Warszawa',
-                        'nip': nip_match.group()
-                    }
-        
-        return None
-        
-    except Exception as e:
-        print(f"Błąd wyszukiwania polskiego: {e}")
+        # shield: anulowanie jednego oczekującego nie przerywa wyszukiwania pozostałym
+        return await asyncio.shield(inflight.task)
+    finally:
+        inflight.waiters -= 1
+        if on_progress is not None:
+            inflight.listeners.remove(on_progress)
+        if not inflight.waiters and not inflight.task.done():
+            print(f"🛑 Anuluję porzucone wyszukiwanie: {key[1]}")
+            # Nowe zapytanie o ten klucz zaczyna własne wyszukiwanie zamiast dołączać do anulowanego
+            _forget_inflight(key, inflight)
+            inflight.task.cancel()
+
+async def search_polish_registry(query):
+    """Wyszukaj w polskich rejestrach (lokalny indeks NIP ze zrzutów KRS/CEIDG)"""
+    nip_match = re.search(r'\d{10}', query)
+    if not nip_match or not is_valid_nip(nip_match.group()):
         return None
+    
+    nip = nip_match.group()
+    record = await asyncio.to_thread(nip_index.lookup, nip)
+    if record is None:
+        # NIP poprawny, ale firmy nie ma w zrzucie - pozostałe pola uzupełnią inne źródła
+        return {'nazwa_firmy': 'Brak danych', 'imie_nazwisko': 'Brak danych', 'adres': 'Brak danych', 'nip': nip}
+    return record
+
+# === PULA PROCESÓW PARSOWANIA ===
+# Parsowanie HTML i ekstrakcja regexami są CPU-bound: z PARSE_WORKERS > 0 trafiają
+# do osobnych procesów (surowe bajty na wejściu, słownik pól na wyjściu), a pętla
+# zdarzeń zajmuje się tylko I/O i Telegramem. 0 = parsowanie w pętli zdarzeń.
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', 0))
+_parse_pool = None
+
+def get_parse_pool():
+    """Pula procesów parsujących (tworzona przy pierwszym użyciu)"""
+    global _parse_pool
+    if _parse_pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn: fork procesu z wątkami (asyncio.to_thread, sqlite) grozi zakleszczeniem
+        _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _parse_pool
+
+async def run_parser(source, parser, *args):
+    """Uruchom parser źródła w puli procesów albo, bez puli, bezpośrednio w pętli"""
+    global _parse_pool
+    if PARSE_WORKERS <= 0:
+        return parser(*args)
+    
+    from concurrent.futures.process import BrokenProcessPool
+    
+    # Ślad zapytania (contextvars) nie przechodzi do innego procesu,
+    # więc parsowanie + ekstrakcję mierzymy tu jako jeden etap
+    with trace_stage('parse', source=source, worker='process'):
+        try:
+            return await asyncio.get_running_loop().run_in_executor(get_parse_pool(), parser, *args)
+        except BrokenProcessPool:
+            # Proces parsujący padł - następne wywołanie utworzy nową pulę
+            _parse_pool = None
+            raise
+
+def close_parse_pool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = None
+
+# Ile pierwszych wyników DuckDuckGo analizujemy
+DUCKDUCKGO_TOP_RESULTS = 5
+# html.parser widzi atrybut class jako jeden napis, więc dopasowujemy słowo 'result'
+RESULT_CLASS_PATTERN = re.compile(r'(?:^|\s)result(?:\s|$)')
+
+_etree = None  # lxml.etree; False = brak lxml; None = jeszcze nie importowano
+
+def get_etree():
+    """lxml.etree albo None, gdy lxml nie jest zainstalowane (import przy pierwszym użyciu)"""
+    global _etree
+    if _etree is None:
+        try:
+            from lxml import etree
+            _etree = etree
+        except ImportError:
+            _etree = False
+    return _etree or None
+
+def import_html_parsers():
+    """Zaimportuj parsery HTML z góry (rozgrzewka w tle po starcie)"""
+    if get_etree() is None:
+        import bs4  # noqa: F401
+
+def iter_result_texts(content, limit=DUCKDUCKGO_TOP_RESULTS):
+    """Zwróć teksty pierwszych `limit` bloków div.result bez budowania pełnego drzewa"""
+    etree = get_etree()
+    if etree is not None:
+        # lxml: parsowanie strumieniowe, przerwane po `limit` wynikach
+        texts = []
+        for _, element in etree.iterparse(BytesIO(content), events=('end',), tag='div', html=True, recover=True):
+            if 'result' in (element.get('class') or '').split():
+                texts.append(''.join(element.itertext()))
+                if len(texts) >= limit:
+                    break
+        return texts
+    
+    # Bez lxml: html.parser, ale tylko dla węzłów div.result
+    from bs4 import BeautifulSoup, SoupStrainer
+    soup = BeautifulSoup(content, 'html.parser', parse_only=SoupStrainer('div', class_=RESULT_CLASS_PATTERN))
+    return [result.get_text() for result in soup.find_all('div', class_='result', limit=limit)]
+
+def parse_duckduckgo_results(content, query):
+    """Wyciągnij dane firmy ze strony wyników DuckDuckGo (surowe bajty HTML)"""
+    extracted_data = {
+        'nazwa_firmy': 'Brak danych',
+        'imie_nazwisko': 'Brak danych',
+        'adres': 'Brak danych',
+        'nip': 'Brak danych'
+    }
+    
+    with trace_stage('parse', source='Google Business'):
+        texts = iter_result_texts(content)
+    
+    with trace_stage('extract', source='Google Business'):
+        for text in texts:
+            missing = [field for field in RESULT_FIELDS if extracted_data[field] == 'Brak danych']
+            if not missing:
+                break
+            
+            # Wyciągnij brakujące pola jednym wywołaniem silnika ekstrakcji
+            fields = extract_fields(text, query, missing)
+            extracted_data.update((field, value) for field, value in fields.items() if value)
+    
+    return extracted_data
 
 async def search_google_business(query):
     """Wyszukaj dane biznesowe przez Google"""
@@ -204,233 +1818,250 @@ async def search_google_business(query):
         encoded_query = quote_plus(search_query)
         
         # Użyj DuckDuckGo (bardziej przyjazne dla botów)
-        search_url = f"https://html.duckduckgo.com/html/?q={encoded_query}"
-        
-        response = requests.get(search_url, headers=headers, timeout=15)
-        
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Wyciągnij dane z wyników wyszukiwania
-            results = soup.find_all('div', class_='result')
-            
-            extracted_data = {
-                'nazwa_firmy': 'Brak danych',
-                'imie_nazwisko': 'Brak danych',
-                'adres': 'Brak danych',
-                'nip': 'Brak danych'
-            }
-            
-            for result in results[:5]:  # Sprawdź pierwsze 5 wyników
-                text = result.get_text()
-                
-                # Wyciągnij nazwę firmy
-                if extracted_data['nazwa_firmy'] == 'Brak danych':
-                    company_name = extract_company_name(text, query)
-                    if company_name:
-                        extracted_data['nazwa_firmy'] = company_name
-                
-                # Wyciągnij adres
-                if extracted_data['adres'] == 'Brak danych':
-                    address = extract_address(text)
-                    if address:
-                        extracted_data['adres'] = address
-                
-                # Wyciągnij CEO/właściciela
-                if extracted_data['imie_nazwisko'] == 'Brak danych':
-                    person = extract_person_name(text, query)
-                    if person:
-                        extracted_data['imie_nazwisko'] = person
-                        
-                # Wyciągnij NIP/identyfikator
-                if extracted_data['nip'] == 'Brak danych':
-                    identifier = extract_business_id(text)
-                    if identifier:
-                        extracted_data['nip'] = identifier
-            
-            return extracted_data
+        search_url = f"{DUCKDUCKGO_URL}?q={encoded_query}"
+        
+        response = await http_get(search_url, headers=headers, timeout=15)
+        
+        if response.status_code != 200:
+            # Np. 403 albo strona anty-botowa - błąd źródła, a nie "brak wyników" do cache
+            raise SourceUnavailable(f"HTTP {response.status_code}")
+        return await run_parser('Google Business', parse_duckduckgo_results, response.content, query)
             
     except Exception as e:
         print(f"Błąd Google search: {e}")
-        return None
+        raise
+
+def parse_opencorporates_response(content):
+    """Wyciągnij dane pierwszej firmy z odpowiedzi OpenCorporates (surowy JSON)"""
+    with trace_stage('parse', source='International Registry'):
+        data = json.loads(content)
+    
+    if data.get('results') and data['results'].get('companies'):
+        company = data['results']['companies'][0]['company']
+        
+        return {
+            'nazwa_firmy': company.get('name', 'Brak danych'),
+            'imie_nazwisko': 'Brak danych',  # OpenCorporates nie zawsze ma CEO
+            'adres': format_address(company.get('registered_address_in_full', 'Brak danych')),
+            'nip': company.get('company_number', 'Brak danych')
+        }
+    
+    return None
 
 async def search_international_registry(query):
     """Wyszukaj w międzynarodowych rejestrach"""
     try:
         # Wyszukaj w OpenCorporates (międzynarodowa baza firm)
-        api_url = f"https://api.opencorporates.com/v0.4/companies/search"
+        api_url = OPENCORPORATES_URL
         params = {
             'q': query,
             'format': 'json',
             'limit': 1
         }
         
-        response = requests.get(api_url, params=params, timeout=10)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            if data.get('results') and data['results'].get('companies'):
-                company = data['results']['companies'][0]['company']
-                
-                return {
-                    'nazwa_firmy': company.get('name', 'Brak danych'),
-                    'imie_nazwisko': 'Brak danych',  # OpenCorporates nie zawsze ma CEO
-                    'adres': format_address(company.get('registered_address_in_full', 'Brak danych')),
-                    'nip': company.get('company_number', 'Brak danych')
-                }
+        response = await cached_http_get(api_url, params=params, timeout=10)
         
-        return None
+        if response.status_code != 200:
+            raise SourceUnavailable(f"HTTP {response.status_code}")
+        # Pusta lista firm = brak wyników (parser zwraca None)
+        return await run_parser('International Registry', parse_opencorporates_response, response.content)
         
     except Exception as e:
         print(f"Błąd international search: {e}")
-        return None
+        raise
+
+def parse_wikipedia_summary(content, query):
+    """Wyciągnij dane firmy ze streszczenia Wikipedia (surowy JSON)"""
+    with trace_stage('parse', source='Business News'):
+        data = json.loads(content)
+    
+    extract = data.get('extract', '')
+    if extract and len(extract) > 50:
+        
+        # Wyciągnij informacje z opisu Wikipedia
+        with trace_stage('extract', source='Business News'):
+            return {
+                'nazwa_firmy': data.get('title', query),
+                **extract_summary_fields(extract)
+            }
+    
+    return None
 
 async def search_business_news(query):
     """Wyszukaj w źródłach informacyjnych"""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
         # Wyszukaj w Wikipedia (dużo informacji o dużych firmach)
-        wiki_url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{quote_plus(query)}"
-        
-        response = requests.get(wiki_url, headers=headers, timeout=10)
+        wiki_url = f"{WIKIPEDIA_URL}{quote_plus(query)}"
         
-        if response.status_code == 200:
-            data = response.json()
-            
-            extract = data.get('extract', '')
-            if extract and len(extract) > 50:
-                
-                # Wyciągnij informacje z opisu Wikipedia
-                return {
-                    'nazwa_firmy': data.get('title', query),
-                    'imie_nazwisko': extract_ceo_from_text(extract),
-                    'adres': extract_address_from_text(extract),
-                    'nip': extract_business_id_from_text(extract)
-                }
+        response = await cached_http_get(wiki_url, timeout=10)
         
-        return None
+        if response.status_code == 404:
+            # Brak artykułu = brak wyników
+            return None
+        if response.status_code != 200:
+            raise SourceUnavailable(f"HTTP {response.status_code}")
+        return await run_parser('Business News', parse_wikipedia_summary, response.content, query)
         
     except Exception as e:
         print(f"Błąd news search: {e}")
-        return None
+        raise
 
 # === FUNKCJE EKSTRAKCJI DANYCH ===
-def extract_company_name(text, query):
-    """Wyciągnij nazwę firmy z tekstu"""
-    # Sprawdź czy query zawiera rozszerzenia firm
-    extensions = ['Inc', 'Corporation', 'Corp', 'Ltd', 'LLC', 'S.A.', 'Sp. z o.o.', 'GmbH']
-    
-    for ext in extensions:
-        if ext.lower() in text.lower():
-            # Znajdź nazwę z rozszerzeniem
-            pattern = rf'([A-Z][A-Za-z\s]+{re.escape(ext)})'
-            match = re.search(pattern, text, re.IGNORECASE)
+# Wzorce kompilowane raz przy imporcie zamiast przy każdym wywołaniu.
+# Kolejność list = priorytet (pierwszy pasujący wzorzec wygrywa).
+COMPANY_EXTENSIONS = ['Inc', 'Corporation', 'Corp', 'Ltd', 'LLC', 'S.A.', 'Sp. z o.o.', 'GmbH']
+COMPANY_PATTERNS = [
+    (ext.lower(), re.compile(rf'([A-Z][A-Za-z\s]+{re.escape(ext)})', re.IGNORECASE))
+    for ext in COMPANY_EXTENSIONS
+]
+# Nazwa kończąca się formą prawną (ocena pewności scalania)
+COMPANY_SUFFIX_PATTERN = re.compile(
+    r'(?:^|\s)(?:' + '|'.join(re.escape(ext) for ext in COMPANY_EXTENSIONS) + r')\.?$', re.IGNORECASE
+)
+
+ADDRESS_PATTERNS = [re.compile(pattern) for pattern in (
+    r'\d+\s+[A-Z][a-z]+\s+(Street|St|Avenue|Ave|Road|Rd|Way|Drive|Dr)',  # US style
+    r'ul\.\s+[A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż\s]+\d+,\s*\d{2}-\d{3}\s+[A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż]+',  # Polish
+    r'\d{2}-\d{3}\s+[A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż]+',  # Polish postal
+    r'[A-Z][a-z]+,\s+[A-Z]{2}\s+\d{5}',  # US City, State ZIP
+)]
+
+PERSON_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'CEO\s+([A-Z][a-z]+\s+[A-Z][a-z]+)',
+    r'founder\s+([A-Z][a-z]+\s+[A-Z][a-z]+)',
+    r'president\s+([A-Z][a-z]+\s+[A-Z][a-z]+)',
+    r'prezes\s+([A-Z][a-z]+\s+[A-Z][a-z]+)',
+)]
+
+NIP_PATTERN = re.compile(r'\b(\d{3}-\d{3}-\d{2}-\d{2}|\d{10})\b')
+TAX_ID_PATTERN = re.compile(r'\b\d{2}-\d{7}\b')
+
+CEO_PATTERNS = [
+    (keyword.lower(), re.compile(rf'{keyword}[^.]*?([A-Z][a-z]+\s+[A-Z][a-z]+)', re.IGNORECASE))
+    for keyword in ('CEO', 'chief executive', 'founder', 'founded by')
+]
+
+LOCATION_PATTERNS = [
+    (keyword.lower(), re.compile(rf'{keyword}\s+([A-Z][a-z]+(?:,\s+[A-Z][a-z]+)*)', re.IGNORECASE))
+    for keyword in ('headquartered in', 'based in', 'located in', 'headquarters')
+]
+
+ID_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'tax\s+id[:\s]+(\d{2}-\d{7})',
+    r'ein[:\s]+(\d{2}-\d{7})',
+    r'nip[:\s]+(\d{3}-\d{3}-\d{2}-\d{2})',
+)]
+
+RESULT_FIELDS = ('nazwa_firmy', 'adres', 'imie_nazwisko', 'nip')
+
+def _find_company_name(text, lowered):
+    for ext, pattern in COMPANY_PATTERNS:
+        if ext in lowered:
+            match = pattern.search(text)
             if match:
                 return match.group(1).strip()
-    
-    # Jeśli nie ma rozszerzenia, użyj query jako nazwy
-    return query.title()
+    return None
 
-def extract_address(text):
-    """Wyciągnij adres z tekstu"""
-    # Wzorce adresów
-    address_patterns = [
-        r'\d+\s+[A-Z][a-z]+\s+(Street|St|Avenue|Ave|Road|Rd|Way|Drive|Dr)',  # US style
-        r'ul\.\s+[A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż\s]+\d+,\s*\d{2}-\d{3}\s+[A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż]+',  # Polish
-        r'\d{2}-\d{3}\s+[A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż]+',  # Polish postal
-        r'[A-Z][a-z]+,\s+[A-Z]{2}\s+\d{5}',  # US City, State ZIP
-    ]
-    
-    for pattern in address_patterns:
-        match = re.search(pattern, text)
+def _find_address(text):
+    for pattern in ADDRESS_PATTERNS:
+        match = pattern.search(text)
         if match:
             return match.group(0).strip()
-    
     return 'Brak danych'
 
-def extract_person_name(text, query):
-    """Wyciągnij imię i nazwisko z tekstu"""
-    # Szukaj CEO, Founder, President
-    ceo_patterns = [
-        r'CEO\s+([A-Z][a-z]+\s+[A-Z][a-z]+)',
-        r'founder\s+([A-Z][a-z]+\s+[A-Z][a-z]+)',
-        r'president\s+([A-Z][a-z]+\s+[A-Z][a-z]+)',
-        r'prezes\s+([A-Z][a-z]+\s+[A-Z][a-z]+)',
-    ]
-    
-    for pattern in ceo_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+def _find_person(text):
+    for pattern in PERSON_PATTERNS:
+        match = pattern.search(text)
         if match:
             return match.group(1)
-    
+    return None
+
+def _query_as_person(query):
     # Jeśli query wygląda jak imię nazwisko
-    if len(query.split()) == 2 and all(word[0].isupper() for word in query.split()):
+    words = query.split()
+    if len(words) == 2 and all(word[0].isupper() for word in words):
         return query
-    
     return 'Brak danych'
 
-def extract_business_id(text):
-    """Wyciągnij identyfikator biznesowy"""
-    # Polskie NIP
-    nip_match = re.search(r'\b(\d{3}-\d{3}-\d{2}-\d{2}|\d{10})\b', text)
+def _find_business_id(text):
+    # Polskie NIP, potem US Tax ID
+    nip_match = NIP_PATTERN.search(text)
     if nip_match:
         return nip_match.group(1)
-    
-    # US Tax ID
-    tax_match = re.search(r'\b\d{2}-\d{7}\b', text)
+    tax_match = TAX_ID_PATTERN.search(text)
     if tax_match:
         return tax_match.group(0)
-    
     return 'Brak danych'
 
-def extract_ceo_from_text(text):
-    """Wyciągnij CEO z tekstu Wikipedia"""
-    ceo_keywords = ['CEO', 'chief executive', 'founder', 'founded by']
-    
-    for keyword in ceo_keywords:
-        if keyword.lower() in text.lower():
-            # Znajdź nazwisko po słowie kluczowym
-            pattern = rf'{keyword}[^.]*?([A-Z][a-z]+\s+[A-Z][a-z]+)'
-            match = re.search(pattern, text, re.IGNORECASE)
+def _find_after_keyword(text, lowered, keyword_patterns):
+    for keyword, pattern in keyword_patterns:
+        if keyword in lowered:
+            match = pattern.search(text)
             if match:
                 return match.group(1)
-    
     return 'Brak danych'
 
+def _find_id_in_text(text):
+    for pattern in ID_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return match.group(1)
+    return 'Brak danych'
+
+def extract_fields(text, query, fields=RESULT_FIELDS):
+    """Wyciągnij wybrane pola z tekstu wyniku wyszukiwania (tekst obniżany raz)"""
+    lowered = text.lower() if 'nazwa_firmy' in fields else None
+    extracted = {}
+    
+    for field in fields:
+        if field == 'nazwa_firmy':
+            extracted[field] = _find_company_name(text, lowered) or query.title()
+        elif field == 'adres':
+            extracted[field] = _find_address(text)
+        elif field == 'imie_nazwisko':
+            extracted[field] = _find_person(text) or _query_as_person(query)
+        elif field == 'nip':
+            extracted[field] = _find_business_id(text)
+    
+    return extracted
+
+def extract_summary_fields(text):
+    """Wyciągnij CEO, lokalizację i identyfikator z tekstu opisowego (np. Wikipedia)"""
+    lowered = text.lower()
+    return {
+        'imie_nazwisko': _find_after_keyword(text, lowered, CEO_PATTERNS),
+        'adres': _find_after_keyword(text, lowered, LOCATION_PATTERNS),
+        'nip': _find_id_in_text(text),
+    }
+
+def extract_company_name(text, query):
+    """Wyciągnij nazwę firmy z tekstu"""
+    # Jeśli nie ma rozszerzenia, użyj query jako nazwy
+    return _find_company_name(text, text.lower()) or query.title()
+
+def extract_address(text):
+    """Wyciągnij adres z tekstu"""
+    return _find_address(text)
+
+def extract_person_name(text, query):
+    """Wyciągnij imię i nazwisko z tekstu"""
+    return _find_person(text) or _query_as_person(query)
+
+def extract_business_id(text):
+    """Wyciągnij identyfikator biznesowy"""
+    return _find_business_id(text)
+
+def extract_ceo_from_text(text):
+    """Wyciągnij CEO z tekstu Wikipedia"""
+    return _find_after_keyword(text, text.lower(), CEO_PATTERNS)
+
 def extract_address_from_text(text):
     """Wyciągnij adres z tekstu opisowego"""
-    # Szukaj miast i stanów
-    location_keywords = ['headquartered in', 'based in', 'located in', 'headquarters']
-    
-    for keyword in location_keywords:
-        if keyword.lower() in text.lower():
-            # Znajdź lokalizację po słowie kluczowym
-            pattern = rf'{keyword}\s+([A-Z][a-z]+(?:,\s+[A-Z][a-z]+)*)'
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                return match.group(1)
-    
-    return 'Brak danych'
+    return _find_after_keyword(text, text.lower(), LOCATION_PATTERNS)
 
 def extract_business_id_from_text(text):
     """Wyciągnij identyfikator z tekstu"""
-    # Szukaj różnych formatów ID
-    id_patterns = [
-        r'tax\s+id[:\s]+(\d{2}-\d{7})',
-        r'ein[:\s]+(\d{2}-\d{7})',
-        r'nip[:\s]+(\d{3}-\d{3}-\d{2}-\d{2})',
-    ]
-    
-    for pattern in id_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            return match.group(1)
-    
-    return 'Brak danych'
+    return _find_id_in_text(text)
 
 def format_address(address):
     """Sformatuj adres"""
@@ -442,9 +2073,75 @@ def format_address(address):
     return formatted
 
 # === SZABLONY ===
-def get_szablon_uzytkownika(user_id):
-    """Pobierz szablon użytkownika lub zwróć domyślny"""
-    return user_templates.get(user_id, get_default_template())
+# Szablony są parsowane i sprawdzane raz (przy /szablon), a odpowiedź to już tylko
+# podstawienie pól. Szablony użytkowników leżą w SQLite, w pamięci jest ograniczony LRU.
+TEMPLATE_DB_PATH = os.environ.get('TEMPLATE_DB_PATH', os.path.join(DATA_DIR, 'templates.sqlite3'))
+TEMPLATE_CACHE_SIZE = int(os.environ.get('TEMPLATE_CACHE_SIZE', 10000))
+TEMPLATE_MAX_LENGTH = 2000
+TEMPLATE_FIELDS = ('nazwa_firmy', 'imie_nazwisko', 'adres', 'nip', 'źródło', 'data')
+TEMPLATE_CONVERSIONS = {None: str, 's': str, 'r': repr, 'a': ascii}
+# Szerokość i precyzja w formacie pola ({nip:>300000000} alokowałoby setki MB przy każdej odpowiedzi)
+TEMPLATE_MAX_WIDTH = 200
+FORMAT_SPEC_PATTERN = re.compile(
+    r'(?:.?[<>=^])?[-+ ]?z?#?0?(?P<width>\d*)[,_]?(?:\.(?P<precision>\d*))?[bcdeEfFgGnosxX%]?', re.DOTALL
+)
+
+class TemplateError(ValueError):
+    pass
+
+class CompiledTemplate:
+    """Szablon sprawdzony przy kompilacji; render() to jedno podstawienie %-formatu"""
+    
+    def __init__(self, source):
+        self.source = source
+        self.fields = set()
+        self._formatted = []  # (klucz, pole, konwersja, format) dla pól z !konwersją lub :formatem
+        parts = []
+        try:
+            parsed = list(string.Formatter().parse(source))
+        except ValueError as e:
+            raise TemplateError(f"niepoprawne nawiasy klamrowe ({e})")
+        
+        for literal, field, spec, conversion in parsed:
+            parts.append(literal.replace('%', '%%'))
+            if field is None:
+                continue
+            if field not in TEMPLATE_FIELDS:
+                raise TemplateError(f"nieznane pole {{{field}}}")
+            if conversion not in TEMPLATE_CONVERSIONS or '{' in spec:
+                raise TemplateError(f"nieobsługiwany format pola {{{field}}}")
+            spec_match = FORMAT_SPEC_PATTERN.fullmatch(spec)
+            if spec_match is None:
+                raise TemplateError(f"niepoprawny format pola {{{field}}}")
+            if any(int(spec_match[part] or 0) > TEMPLATE_MAX_WIDTH for part in ('width', 'precision')):
+                raise TemplateError(f"za duża szerokość lub precyzja pola {{{field}}} (limit {TEMPLATE_MAX_WIDTH})")
+            self.fields.add(field)
+            if conversion is None and not spec:
+                parts.append(f'%({field})s')
+            else:
+                key = f'{len(self._formatted)}:{field}'
+                self._formatted.append((key, field, TEMPLATE_CONVERSIONS[conversion], spec))
+                parts.append(f'%({key})s')
+        self._format = ''.join(parts)
+        
+        # Błędny format (np. {nip:d}) ma wyjść teraz, a nie przy pierwszej odpowiedzi
+        try:
+            self.render(dict.fromkeys(TEMPLATE_FIELDS, 'Brak danych'))
+        except (ValueError, TypeError) as e:
+            raise TemplateError(f"niepoprawny format pola ({e})")
+    
+    def render(self, values):
+        if self._formatted:
+            values = dict(values)
+            for key, field, convert, spec in self._formatted:
+                values[key] = format(convert(values[field]), spec)
+        return self._format % values
+
+def compile_template(text):
+    """Skompiluj szablon odpowiedzi; TemplateError z opisem, gdy jest niepoprawny"""
+    if len(text) > TEMPLATE_MAX_LENGTH:
+        raise TemplateError(f"za długi szablon (limit {TEMPLATE_MAX_LENGTH} znaków)")
+    return CompiledTemplate(text)
 
 def get_default_template():
     """Domyślny szablon odpowiedzi"""
@@ -460,30 +2157,135 @@ def get_default_template():
 
 *Wyszukane na żywo z internetu*"""
 
+DEFAULT_TEMPLATE = compile_template(get_default_template())
+
+class TemplateStore:
+    """Szablony użytkowników: SQLite na dysku + skompilowane szablony w LRU w pamięci"""
+    
+    def __init__(self, path, max_items):
+        self.path = path
+        self.max_items = max_items
+        self._memory = OrderedDict()  # użytkownik -> CompiledTemplate (None = domyślny)
+        self._db = None
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS user_templates (user_id INTEGER PRIMARY KEY, template TEXT, updated_at REAL)'
+            )
+        return self._db
+    
+    def _db_get(self, user_id):
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    'SELECT template FROM user_templates WHERE user_id = ?', (user_id,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Błąd szablonów (odczyt): {e}")
+            return None
+        return row[0] if row else None
+    
+    def _db_set(self, user_id, text):
+        try:
+            with self._lock:
+                db = self._connect()
+                if text is None:
+                    db.execute('DELETE FROM user_templates WHERE user_id = ?', (user_id,))
+                else:
+                    db.execute('INSERT OR REPLACE INTO user_templates VALUES (?, ?, ?)', (user_id, text, time.time()))
+                db.commit()
+        except sqlite3.Error as e:
+            print(f"Błąd szablonów (zapis): {e}")
+    
+    def _remember(self, user_id, template):
+        self._memory[user_id] = template
+        self._memory.move_to_end(user_id)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+    
+    async def get(self, user_id):
+        """Skompilowany szablon użytkownika albo domyślny"""
+        if user_id in self._memory:
+            self._memory.move_to_end(user_id)
+            template = self._memory[user_id]
+        else:
+            text = await asyncio.to_thread(self._db_get, user_id)
+            template = None
+            if text is not None:
+                try:
+                    template = compile_template(text)
+                except TemplateError as e:
+                    print(f"Pominięto zapisany szablon użytkownika {user_id}: {e}")
+            if user_id in self._memory:
+                # set()/reset() w trakcie odczytu - nowszy szablon wygrywa z odczytanym z bazy
+                template = self._memory[user_id]
+            else:
+                self._remember(user_id, template)
+        return template or DEFAULT_TEMPLATE
+    
+    async def set(self, user_id, text):
+        """Skompiluj i zapisz szablon (TemplateError, gdy niepoprawny - nic nie jest zapisywane)"""
+        template = compile_template(text)
+        self._remember(user_id, template)
+        await asyncio.to_thread(self._db_set, user_id, text)
+        return template
+    
+    async def reset(self, user_id):
+        self._remember(user_id, None)
+        await asyncio.to_thread(self._db_set, user_id, None)
+
+template_store = TemplateStore(TEMPLATE_DB_PATH, TEMPLATE_CACHE_SIZE)
+
+async def get_szablon_uzytkownika(user_id):
+    """Pobierz szablon użytkownika lub zwróć domyślny"""
+    return await template_store.get(user_id)
+
+_compiled_strings = OrderedDict()
+_date_text = (None, '')
+
+def current_date_text():
+    """Data do szablonu; tekst liczony raz na minutę zamiast przy każdej odpowiedzi"""
+    global _date_text
+    minute = int(time.time() // 60)
+    if _date_text[0] != minute:
+        _date_text = (minute, datetime.now().strftime("%d.%m.%Y %H:%M"))
+    return _date_text[1]
+
 def format_response(info, szablon):
-    """Sformatuj odpowiedź według szablonu"""
-    data = datetime.now().strftime("%d.%m.%Y %H:%M")
+    """Sformatuj odpowiedź według szablonu (CompiledTemplate albo tekst szablonu)"""
+    if not isinstance(szablon, CompiledTemplate):
+        compiled = _compiled_strings.get(szablon)
+        if compiled is None:
+            try:
+                compiled = compile_template(szablon)
+            except TemplateError as e:
+                return f"❌ Błąd szablonu: {e}. Użyj: nazwa_firmy, imie_nazwisko, adres, nip, źródło, data"
+            _compiled_strings[szablon] = compiled
+            if len(_compiled_strings) > 100:
+                _compiled_strings.popitem(last=False)
+        szablon = compiled
     
-    try:
-        formatted = szablon.format(
-            nazwa_firmy=info.get('nazwa_firmy', 'Brak danych'),
-            imie_nazwisko=info.get('imie_nazwisko', 'Brak danych'),
-            adres=info.get('adres', 'Brak danych'),
-            nip=info.get('nip', 'Brak danych'),
-            źródło=info.get('źródło', 'Internet'),
-            data=data
-        )
-        return formatted
-    except KeyError as e:
-        return f"❌ Błąd szablonu: {e}. Użyj: nazwa_firmy, imie_nazwisko, adres, nip, źródło, data"
+    return szablon.render({
+        'nazwa_firmy': info.get('nazwa_firmy', 'Brak danych'),
+        'imie_nazwisko': info.get('imie_nazwisko', 'Brak danych'),
+        'adres': info.get('adres', 'Brak danych'),
+        'nip': info.get('nip', 'Brak danych'),
+        'źródło': info.get('źródło', 'Internet'),
+        'data': current_date_text(),
+    })
 
 async def ustaw_szablon(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ustaw własny szablon odpowiedzi"""
+    commands_total.inc(command='szablon')
     if not context.args:
-        current_template = get_szablon_uzytkownika(update.effective_user.id)
+        current_template = await get_szablon_uzytkownika(update.effective_user.id)
         await update.message.reply_text(
             f"🎯 **AKTUALNY SZABLON:**\n\n"
-            f"```\n{current_template}\n```\n\n"
+            f"```\n{current_template.source}\n```\n\n"
             f"**Zmienne:** `{{nazwa_firmy}}` `{{imie_nazwisko}}` `{{adres}}` `{{nip}}` `{{źródło}}` `{{data}}`\n\n"
             f"**Użycie:** `/szablon [format]` lub `/szablon reset`"
         , parse_mode='Markdown')
@@ -492,12 +2294,17 @@ async def ustaw_szablon(update: Update, context: ContextTypes.DEFAULT_TYPE):
     szablon_text = " ".join(context.args)
     
     if szablon_text.lower() == "reset":
-        if update.effective_user.id in user_templates:
-            del user_templates[update.effective_user.id]
+        await template_store.reset(update.effective_user.id)
         await update.message.reply_text("✅ Szablon zresetowany!")
         return
     
-    user_templates[update.effective_user.id] = szablon_text
+    try:
+        await template_store.set(update.effective_user.id, szablon_text)
+    except TemplateError as e:
+        await update.message.reply_text(
+            f"❌ Błąd szablonu: {e}. Użyj: nazwa_firmy, imie_nazwisko, adres, nip, źródło, data"
+        )
+        return
     
     await update.message.reply_text(
         f"✅ **Szablon zapisany!**\n\n"
@@ -505,6 +2312,131 @@ async def ustaw_szablon(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Testuj wpisując nazwę firmy!"
     , parse_mode='Markdown')
 
+# === RÓWNOLEGŁA OBSŁUGA AKTUALIZACJI ===
+# Ile aktualizacji obsługujemy naraz i ile może równocześnie czekać na kolej
+# w czacie lub na workera. To nie jest limit kolejki: PTB tworzy zadanie dla
+# każdej pobranej aktualizacji, nadmiarowe czekają na semaforze bez ograniczeń
+UPDATE_WORKERS = int(os.environ.get('UPDATE_WORKERS', 8))
+UPDATE_QUEUE_LIMIT = int(os.environ.get('UPDATE_QUEUE_LIMIT', 256))
+# Limit równoczesnych wyszukiwań jednego użytkownika (we wszystkich czatach)
+MAX_SEARCHES_PER_USER = int(os.environ.get('MAX_SEARCHES_PER_USER', 2))
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Równoległe przetwarzanie aktualizacji z zachowaniem kolejności w obrębie czatu.
+    
+    Bazowy semafor ogranicza liczbę aktualizacji czekających na swoją kolej
+    w czacie lub na workera (`max_active`), a pula `workers` liczbę faktycznie
+    wykonywanych. Aktualizacja najpierw czeka na swoją kolej w czacie, dopiero
+    potem zajmuje workera - czat z długą kolejką wiadomości blokuje najwyżej
+    jednego workera. Nie daje to przeciwciśnienia: PTB i tak tworzy zadanie dla
+    każdej pobranej aktualizacji, a nadmiarowe czekają na bazowym semaforze.
+    """
+    
+    def __init__(self, workers, max_active):
+        super().__init__(max(workers, max_active))
+        self.workers = workers
+        self._worker_slots = asyncio.Semaphore(workers)
+        self._chat_locks = {}
+        self._chat_pending = {}
+    
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._worker_slots:
+                await coroutine
+            return
+        
+        lock = self._chat_locks.setdefault(chat.id, asyncio.Lock())
+        self._chat_pending[chat.id] = self._chat_pending.get(chat.id, 0) + 1
+        try:
+            async with lock, self._worker_slots:
+                await coroutine
+        finally:
+            self._chat_pending[chat.id] -= 1
+            if not self._chat_pending[chat.id]:
+                del self._chat_pending[chat.id]
+                del self._chat_locks[chat.id]
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+# Wyszukiwania w toku per użytkownik
+_user_searches = {}
+
+# === STRUMIENIOWANIE ODPOWIEDZI ===
+# Minimalny odstęp między edycjami jednej wiadomości (limity Telegrama są ostrzejsze w grupach)
+EDIT_MIN_INTERVAL = float(os.environ.get('EDIT_MIN_INTERVAL', 1.0))
+EDIT_MIN_INTERVAL_GROUP = float(os.environ.get('EDIT_MIN_INTERVAL_GROUP', 3.0))
+PROGRESS_SUFFIX = "\n\n⏳ _Szukam w kolejnych źródłach..._"
+# Wynik gotowy w tym czasie (cache, indeks nazw) idzie od razu, bez placeholdera i edycji
+PLACEHOLDER_DELAY = float(os.environ.get('PLACEHOLDER_DELAY', 0.3))
+
+class ThrottledEditor:
+    """Edytuje jedną wiadomość najwyżej raz na `interval`; pośrednie wersje mogą zostać pominięte"""
+    
+    def __init__(self, message, interval):
+        self.message = message
+        self.interval = interval
+        self.last_text = message.text
+        # Pierwsza edycja nie czeka: wysłanie wiadomości nie liczy się jako edycja
+        self.last_edit = float('-inf')
+        self._pending = None
+        self._task = None
+    
+    def update(self, text):
+        """Zaplanuj edycję bez czekania; nowsza treść zastępuje jeszcze niewysłaną"""
+        self._pending = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+    
+    async def _wait_turn(self):
+        delay = self.last_edit + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    async def _flush(self):
+        while self._pending is not None:
+            await self._wait_turn()
+            text, self._pending = self._pending, None
+            if text is None:
+                return
+            try:
+                await self._edit(text)
+            except RetryAfter as e:
+                # Częściowy wynik można pominąć - następna edycja i tak przyjdzie
+                self.last_edit = time.monotonic() + e.retry_after
+            except Exception as e:
+                print(f"Błąd edycji wiadomości: {e}")
+                return
+    
+    async def _edit(self, text):
+        if text == self.last_text:
+            return
+        try:
+            with trace_stage('send', message='edit'):
+                await self.message.edit_text(text, parse_mode='Markdown')
+            self.last_text = text
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                raise
+        finally:
+            self.last_edit = max(self.last_edit, time.monotonic())
+    
+    async def finish(self, text):
+        """Wyślij ostateczną treść (zawsze, z zachowaniem odstępu od poprzedniej edycji)"""
+        self._pending = None
+        if self._task is not None and not self._task.done():
+            await self._task
+        await self._wait_turn()
+        try:
+            await self._edit(text)
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            await self._edit(text)
+
 # === GŁÓWNA FUNKCJA WYSZUKIWANIA ===
 async def live_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Obsługuj wyszukiwanie na żywo"""
@@ -518,25 +2450,683 @@ async def live_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("❌ Za krótkie zapytanie. Wpisz nazwę firmy.")
         return
     
-    await update.message.reply_text(f"🔍 **LIVE SEARCH:** {query}\n⏳ Przeszukuję internet...", parse_mode='Markdown')
+    nip_query = NIP_QUERY_PATTERN.match(canonical_query(query))
+    if nip_query and not is_valid_nip(nip_query.group(1)):
+        await update.message.reply_text("❌ Nieprawidłowy NIP - błędna suma kontrolna. Sprawdź numer.")
+        return
+    
+    user_id = update.effective_user.id
+    if _user_searches.get(user_id, 0) >= MAX_SEARCHES_PER_USER:
+        searches_total.inc(status='rejected')
+        await update.message.reply_text("⏳ Poczekaj na wyniki poprzednich wyszukiwań.")
+        return
+    
+    trace = QueryTrace(query, user_id)
+    current_trace.set(trace)
+    status = 'ok'
     
+    _user_searches[user_id] = _user_searches.get(user_id, 0) + 1
     try:
-        # Wyszukiwanie na żywo
-        business_data = await live_business_search(query)
-        
         # Szablon użytkownika
-        szablon = get_szablon_uzytkownika(update.effective_user.id)
+        szablon = await get_szablon_uzytkownika(update.effective_user.id)
+        
+        # Placeholder jest edytowany w miejscu, gdy kolejne źródła odpowiadają
+        interval = EDIT_MIN_INTERVAL if update.effective_chat.type == 'private' else EDIT_MIN_INTERVAL_GROUP
+        editor = None
+        latest = None
+        
+        def show_progress(partial):
+            nonlocal latest
+            latest = partial
+            if editor is not None:
+                editor.update(format_response(partial, szablon) + PROGRESS_SUFFIX)
+        
+        # Wyszukiwanie na żywo; placeholder tylko wtedy, gdy wynik nie przyjdzie od razu
+        search = asyncio.create_task(shared_business_search(query, user_id, show_progress))
+        try:
+            await asyncio.wait({search}, timeout=PLACEHOLDER_DELAY)
+            if not search.done():
+                with trace_stage('send', message='placeholder'):
+                    placeholder = await update.message.reply_text(f"🔍 **LIVE SEARCH:** {query}\n⏳ Przeszukuję internet...", parse_mode='Markdown')
+                editor = ThrottledEditor(placeholder, interval)
+                if latest is not None:
+                    show_progress(latest)
+            business_data = await search
+        finally:
+            search.cancel()
         
         # Sformatowana odpowiedź
-        formatted_response = format_response(business_data, szablon)
+        with trace_stage('render'):
+            formatted_response = format_response(business_data, szablon)
         
-        await update.message.reply_text(formatted_response, parse_mode='Markdown')
+        if editor is None:
+            with trace_stage('send', message='result'):
+                await update.message.reply_text(formatted_response, parse_mode='Markdown')
+        else:
+            try:
+                await editor.finish(formatted_response)
+            except Exception as e:
+                # Np. placeholder usunięty - wyślij wynik jako nową wiadomość
+                print(f"Błąd edycji wyniku: {e}")
+                with trace_stage('send', message='result'):
+                    await update.message.reply_text(formatted_response, parse_mode='Markdown')
+        mark_milestone('first_reply')
         
     except Exception as e:
+        status = 'error'
         await update.message.reply_text(
             f"❌ **Błąd wyszukiwania:** {str(e)}\n"
             f"Spróbuj z inną nazwą firmy."
         )
+    finally:
+        searches_total.inc(status=status)
+        trace.finish(status)
+        _user_searches[user_id] -= 1
+        if not _user_searches[user_id]:
+            del _user_searches[user_id]
+
+# === TRYB INLINE (@bot nazwa firmy) ===
+# Zapytania inline przychodzą przy każdym naciśnięciu klawisza: czekamy na przerwę
+# w pisaniu, anulujemy nieaktualne wyszukiwania i krótko pamiętamy odpowiedzi
+INLINE_DEBOUNCE = float(os.environ.get('INLINE_DEBOUNCE', 0.6))
+INLINE_MIN_LENGTH = int(os.environ.get('INLINE_MIN_LENGTH', 3))
+INLINE_CACHE_TTL = int(os.environ.get('INLINE_CACHE_TTL', 60))
+INLINE_CACHE_SIZE = int(os.environ.get('INLINE_CACHE_SIZE', 500))
+INLINE_SUGGESTIONS = int(os.environ.get('INLINE_SUGGESTIONS', 5))
+
+_inline_latest = {}  # użytkownik -> id najnowszego zapytania inline
+_inline_tasks = {}  # użytkownik -> (klucz zapytania, trwające wyszukiwanie inline)
+_inline_answers = OrderedDict()  # klucz zapytania -> (ważne do, wynik)
+
+def _cached_inline_answer(key):
+    entry = _inline_answers.get(key)
+    if entry is None or entry[0] < time.monotonic():
+        _inline_answers.pop(key, None)
+        return None
+    _inline_answers.move_to_end(key)
+    return entry[1]
+
+def _remember_inline_answer(key, data):
+    _inline_answers[key] = (time.monotonic() + INLINE_CACHE_TTL, data)
+    _inline_answers.move_to_end(key)
+    while len(_inline_answers) > INLINE_CACHE_SIZE:
+        _inline_answers.popitem(last=False)
+
+def build_inline_results(found, szablon):
+    """Wyniki wyszukiwania jako artykuły inline (treść wg szablonu użytkownika)"""
+    articles = {}
+    for data in found:
+        description = ' • '.join(
+            value for value in (data.get('imie_nazwisko'), data.get('adres'), data.get('nip'))
+            if value and value != 'Brak danych'
+        )
+        article_id = normalize_query(data.get('nazwa_firmy', ''))[:64] or 'wynik'
+        articles.setdefault(article_id, InlineQueryResultArticle(
+            id=article_id,
+            title=f"🏢 {data.get('nazwa_firmy', 'Brak danych')}",
+            description=description or 'Brak szczegółów',
+            input_message_content=InputTextMessageContent(format_response(data, szablon), parse_mode='Markdown'),
+        ))
+    return list(articles.values())
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Obsłuż @bot zapytanie: krótki cache od razu, wyszukiwanie po debounce w tle"""
+    inline_query = update.inline_query
+    query = ' '.join(inline_query.query.split())
+    user_id = inline_query.from_user.id
+    
+    if not INLINE_MIN_LENGTH <= len(query) <= 100:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TTL)
+        return
+    
+    key = normalize_query(query)
+    szablon = await get_szablon_uzytkownika(user_id)
+    
+    # Nowsze zapytanie użytkownika anuluje poprzednie wyszukiwanie (o ile szuka czegoś innego)
+    previous = _inline_tasks.get(user_id)
+    if previous is not None and previous[0] != key and not previous[1].done():
+        previous[1].cancel()
+    
+    # Podpowiedzi z indeksu nazw: znane firmy pasujące do tego, co już wpisano.
+    # Nazwa zaczynająca się od zapytania wystarcza; same podobne nazwy ("Tesla"
+    # dla "Tesco") są tylko dodatkiem do wyniku wyszukiwania
+    suggestions = await asyncio.to_thread(name_index.suggest, query, INLINE_SUGGESTIONS)
+    if any(prefixed for _, prefixed in suggestions):
+        await answer_inline(inline_query, [data for data, _ in suggestions], szablon)
+        return
+    similar = [data for data, _ in suggestions]
+    
+    data = _cached_inline_answer(key)
+    if data is not None:
+        await answer_inline(inline_query, [data] + similar, szablon)
+        return
+    
+    # Debounce i wyszukiwanie w tle - handler nie zajmuje workera, gdy użytkownik pisze
+    _inline_latest[user_id] = inline_query.id
+    schedule_inline_search(inline_query, query, key, szablon, similar)
+
+async def answer_inline(inline_query, found, szablon):
+    """Odpowiedz na zapytanie inline artykułami z wynikami"""
+    commands_total.inc(command='inline')
+    try:
+        await inline_query.answer(build_inline_results(found, szablon), cache_time=INLINE_CACHE_TTL, is_personal=True)
+    except BadRequest as e:
+        # Zapytanie inline wygasło, zanim zdążyliśmy odpowiedzieć
+        print(f"Nie udało się odpowiedzieć inline: {e}")
+
+def schedule_inline_search(inline_query, query, key, szablon, similar=()):
+    """Po przerwie w pisaniu wyszukaj i odpowiedz na zapytanie inline (w tle), z podobnymi firmami pod wynikiem"""
+    user_id = inline_query.from_user.id
+    
+    async def debounced_search():
+        try:
+            await asyncio.sleep(INLINE_DEBOUNCE)
+            # Debounce: jeśli w międzyczasie przyszło nowsze zapytanie, to jest już nieaktualne
+            if _inline_latest.get(user_id) != inline_query.id:
+                return
+            data = await shared_business_search(query, user_id)
+            _remember_inline_answer(key, data)
+            await answer_inline(inline_query, [data, *similar], szablon)
+        except Exception as e:
+            print(f"Błąd wyszukiwania inline: {e}")
+        finally:
+            if _inline_tasks.get(user_id, (None, None))[1] is task:
+                del _inline_tasks[user_id]
+            if _inline_latest.get(user_id) == inline_query.id:
+                del _inline_latest[user_id]
+    
+    task = asyncio.create_task(debounced_search())
+    _inline_tasks[user_id] = (key, task)
+    # Zastąpione (ale nieanulowane) wyszukiwanie też musi zostać zatrzymane przy wyłączaniu
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+# === WYSZUKIWANIE WSADOWE (/batch) ===
+BATCH_DB_PATH = os.environ.get('BATCH_DB_PATH', os.path.join(DATA_DIR, 'batch.sqlite3'))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))
+BATCH_MAX_LINES = int(os.environ.get('BATCH_MAX_LINES', 1000))
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', 512 * 1024))
+BATCH_PROGRESS_INTERVAL = float(os.environ.get('BATCH_PROGRESS_INTERVAL', 10))
+# Jak długo po /batch czekamy na plik od tego użytkownika w tym czacie (sekundy)
+BATCH_PENDING_TTL = float(os.environ.get('BATCH_PENDING_TTL', 600))
+BATCH_BUSY_MESSAGE = "⏳ Masz już trwające zadanie batch. Poczekaj na jego wynik."
+BATCH_CSV_COLUMNS = ('zapytanie', 'nazwa_firmy', 'imie_nazwisko', 'adres', 'nip', 'źródło')
+
+class BatchStore:
+    """Zadania /batch w SQLite - przerwane zadanie jest wznawiane po restarcie"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS batch_jobs ('
+                'id INTEGER PRIMARY KEY, chat_id INTEGER, user_id INTEGER, file_name TEXT, '
+                'status TEXT, created_at REAL)'
+            )
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS batch_items ('
+                'job_id INTEGER, position INTEGER, query TEXT, cache_key TEXT, result TEXT, '
+                'PRIMARY KEY (job_id, position))'
+            )
+        return self._db
+    
+    def create_job(self, chat_id, user_id, file_name, queries):
+        """Utwórz zadanie; None, jeśli użytkownik ma już trwające (sprawdzenie i zapis w jednej transakcji)"""
+        with self._lock:
+            db = self._connect()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                if db.execute(
+                    "SELECT 1 FROM batch_jobs WHERE status = 'running' AND user_id = ?", (user_id,)
+                ).fetchone():
+                    db.rollback()
+                    return None
+                job_id = db.execute(
+                    'INSERT INTO batch_jobs (chat_id, user_id, file_name, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (chat_id, user_id, file_name, 'running', time.time())
+                ).lastrowid
+                db.executemany(
+                    'INSERT INTO batch_items VALUES (?, ?, ?, ?, NULL)',
+                    [(job_id, position, query, normalize_query(query)) for position, query in enumerate(queries)]
+                )
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+            return job_id
+    
+    def get_job(self, job_id):
+        with self._lock:
+            return self._connect().execute(
+                'SELECT id, chat_id, user_id, file_name FROM batch_jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+    
+    def running_jobs(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                rows = self._connect().execute("SELECT id FROM batch_jobs WHERE status = 'running'")
+            else:
+                rows = self._connect().execute(
+                    "SELECT id FROM batch_jobs WHERE status = 'running' AND user_id = ?", (user_id,)
+                )
+            return [row[0] for row in rows]
+    
+    def progress(self, job_id):
+        """(unikalne zapytania gotowe, unikalne zapytania razem, wszystkie wiersze)"""
+        with self._lock:
+            return self._connect().execute(
+                'SELECT COUNT(DISTINCT CASE WHEN result IS NOT NULL THEN cache_key END), '
+                'COUNT(DISTINCT cache_key), COUNT(*) FROM batch_items WHERE job_id = ?', (job_id,)
+            ).fetchone()
+    
+    def pending_queries(self, job_id):
+        """Unikalne (po normalizacji) zapytania bez wyniku: [(cache_key, zapytanie)]"""
+        with self._lock:
+            return self._connect().execute(
+                'SELECT cache_key, MIN(query) FROM batch_items WHERE job_id = ? AND result IS NULL '
+                'GROUP BY cache_key ORDER BY MIN(position)', (job_id,)
+            ).fetchall()
+    
+    def save_result(self, job_id, cache_key, result):
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                'UPDATE batch_items SET result = ? WHERE job_id = ? AND cache_key = ?',
+                (json.dumps(result, ensure_ascii=False), job_id, cache_key)
+            )
+            db.commit()
+    
+    def results(self, job_id):
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT query, result FROM batch_items WHERE job_id = ? ORDER BY position', (job_id,)
+            ).fetchall()
+        return [(query, json.loads(result) if result else {}) for query, result in rows]
+    
+    def finish_job(self, job_id, status):
+        with self._lock:
+            db = self._connect()
+            db.execute('UPDATE batch_jobs SET status = ? WHERE id = ?', (status, job_id))
+            db.execute('DELETE FROM batch_items WHERE job_id = ?', (job_id,))
+            db.commit()
+
+batch_store = BatchStore(BATCH_DB_PATH)
+
+def parse_batch_file(content, file_name):
+    """Zapytania z pliku: jedna linia = jedno zapytanie (w CSV pierwsza kolumna)"""
+    try:
+        text = content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = content.decode('cp1250', errors='replace')
+    
+    if file_name.lower().endswith('.csv'):
+        try:
+            dialect = csv.Sniffer().sniff(text[:64 * 1024], delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+        lines = [row[0] for row in csv.reader(StringIO(text), dialect) if row]
+    else:
+        lines = text.splitlines()
+    
+    queries = (' '.join(line.split()) for line in lines)
+    return [query for query in queries if 2 <= len(query) <= 100]
+
+# Znaki, od których arkusz kalkulacyjny zaczyna formułę
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def csv_safe(value):
+    """Wartość ze strony internetowej nie może stać się formułą w Excelu (CSV injection)"""
+    value = str(value)
+    return f"'{value}" if value.startswith(CSV_FORMULA_PREFIXES) else value
+
+def build_batch_csv(rows):
+    """CSV z wynikami (UTF-8 z BOM, żeby Excel poprawnie pokazał polskie znaki)"""
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(BATCH_CSV_COLUMNS)
+    for query, result in rows:
+        writer.writerow([csv_safe(query)] + [csv_safe(result.get(column, '')) for column in BATCH_CSV_COLUMNS[1:]])
+    return output.getvalue().encode('utf-8-sig')
+
+def start_batch_job(bot, job_id):
+    task = asyncio.create_task(run_batch_job(bot, job_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def run_batch_job(bot, job_id):
+    """Przetwórz zadanie /batch: ograniczona równoległość, postęp, plik CSV na koniec"""
+    _, chat_id, user_id, file_name = await asyncio.to_thread(batch_store.get_job, job_id)
+    done, unique, total = await asyncio.to_thread(batch_store.progress, job_id)
+    search_priority.set(PRIORITY_BACKGROUND)
+    
+    def progress_text():
+        return f"📦 **BATCH** `{file_name}`\n⏳ Postęp: {done}/{unique} unikalnych zapytań ({total} wierszy)"
+    
+    try:
+        progress_message = await bot.send_message(chat_id, progress_text(), parse_mode='Markdown')
+        editor = ThrottledEditor(progress_message, BATCH_PROGRESS_INTERVAL)
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        
+        async def process(cache_key, query):
+            nonlocal done
+            async with semaphore:
+                result = await shared_business_search(query, user_id)
+            await asyncio.to_thread(batch_store.save_result, job_id, cache_key, result)
+            done += 1
+            editor.update(progress_text())
+        
+        pending = await asyncio.to_thread(batch_store.pending_queries, job_id)
+        print(f"📦 Batch {job_id}: {len(pending)} zapytań do wykonania")
+        await asyncio.gather(*(process(cache_key, query) for cache_key, query in pending))
+        
+        rows = await asyncio.to_thread(batch_store.results, job_id)
+        await bot.send_document(
+            chat_id,
+            document=BytesIO(build_batch_csv(rows)),
+            filename=f"wyniki_{os.path.splitext(file_name)[0]}.csv",
+            caption=f"✅ Batch zakończony: {total} wierszy, {unique} unikalnych zapytań",
+        )
+        await editor.finish(f"✅ **BATCH** `{file_name}` zakończony: {unique}/{unique}")
+        await asyncio.to_thread(batch_store.finish_job, job_id, 'done')
+    
+    except asyncio.CancelledError:
+        # Wyłączanie bota - zadanie zostaje 'running' i wznowi się po restarcie
+        raise
+    except Exception as e:
+        print(f"❌ Błąd batch {job_id}: {e}")
+        await asyncio.to_thread(batch_store.finish_job, job_id, 'failed')
+        await bot.send_message(chat_id, f"❌ Batch `{file_name}` przerwany: {e}", parse_mode='Markdown')
+
+async def resume_batch_jobs(bot):
+    """Wznów zadania przerwane restartem procesu"""
+    for job_id in await asyncio.to_thread(batch_store.running_jobs):
+        print(f"📦 Wznawiam batch {job_id}")
+        start_batch_job(bot, job_id)
+
+async def batch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Komenda /batch - instrukcja wyszukiwania wsadowego; następny plik w tym czacie to zadanie"""
+    commands_total.inc(command='batch')
+    context.user_data['batch_requested'] = (update.effective_chat.id, time.monotonic() + BATCH_PENDING_TTL)
+    await update.message.reply_text(
+        f"📦 **WYSZUKIWANIE WSADOWE**\n\n"
+        f"Wyślij teraz plik `.txt` lub `.csv` (albo dowolnie później, z podpisem `/batch`) - "
+        f"jedna nazwa firmy lub NIP w linii "
+        f"(w CSV pierwsza kolumna, najwyżej {BATCH_MAX_LINES} linii).\n"
+        f"Powtórzenia są wyszukiwane raz, a wyniki wrócą jako plik CSV."
+    , parse_mode='Markdown')
+
+def is_batch_requested(update, context):
+    """Czy plik zamówiono przez /batch: w podpisie albo komendą chwilę wcześniej w tym czacie"""
+    caption = (update.message.caption or '').split()
+    if caption and caption[0].split('@')[0] == '/batch':
+        return True
+    requested = context.user_data.get('batch_requested')
+    return bool(requested) and requested[0] == update.effective_chat.id and requested[1] > time.monotonic()
+
+async def batch_document_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Przyjmij plik z zapytaniami i uruchom zadanie /batch"""
+    document = update.message.document
+    user_id = update.effective_user.id
+    
+    # Tylko plik zamówiony przez /batch - inaczej każdy .txt/.csv w dowolnym czacie
+    # uruchamiałby setki wyszukiwań
+    if not is_batch_requested(update, context):
+        if update.effective_chat.type == 'private':
+            await update.message.reply_text("ℹ️ Aby wyszukać firmy z pliku, wyślij najpierw /batch albo dodaj podpis /batch.")
+        return
+    context.user_data.pop('batch_requested', None)
+    
+    if document.file_size and document.file_size > BATCH_MAX_BYTES:
+        await update.message.reply_text(f"❌ Plik za duży (limit {BATCH_MAX_BYTES // 1024} KB).")
+        return
+    
+    # Szybka odmowa przed pobraniem pliku; wiążące sprawdzenie robi create_job
+    if await asyncio.to_thread(batch_store.running_jobs, user_id):
+        await update.message.reply_text(BATCH_BUSY_MESSAGE)
+        return
+    
+    telegram_file = await document.get_file()
+    content = bytes(await telegram_file.download_as_bytearray())
+    file_name = document.file_name or 'batch.txt'
+    queries = parse_batch_file(content, file_name)
+    
+    if not queries:
+        await update.message.reply_text("❌ Plik nie zawiera zapytań (2-100 znaków w linii).")
+        return
+    if len(queries) > BATCH_MAX_LINES:
+        await update.message.reply_text(f"❌ Za dużo linii: {len(queries)} (limit {BATCH_MAX_LINES}).")
+        return
+    
+    job_id = await asyncio.to_thread(batch_store.create_job, update.effective_chat.id, user_id, file_name, queries)
+    if job_id is None:
+        await update.message.reply_text(BATCH_BUSY_MESSAGE)
+        return
+    start_batch_job(context.bot, job_id)
+
+# === SERWER HTTP (health, metryki, webhook) ===
+# Jeden serwer asyncio na PORT: health check Render, /health, /metrics i webhook Telegrama
+PORT = int(os.environ.get('PORT', 10000))
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')  # publiczny adres bota, np. https://bot.onrender.com
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+# Bez skonfigurowanego sekretu losujemy go przy starcie (set_webhook i tak go przekazuje
+# Telegramowi) - webhook bez sekretu przyjąłby podrobione aktualizacje od każdego
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+HTTP_MAX_BODY = int(os.environ.get('HTTP_MAX_BODY', 1024 * 1024))
+HTTP_IDLE_TIMEOUT = float(os.environ.get('HTTP_IDLE_TIMEOUT', 30))
+# Własny serwer Bot API (albo atrapa z benchmarks/loadtest.py) zamiast api.telegram.org
+BOT_API_URL = os.environ.get('BOT_API_URL')
+
+_http_server = None
+
+async def serve_http_connection(reader, writer, handler):
+    """Obsłuż połączenie HTTP/1.1 (z keep-alive); handler(method, path, headers, body) -> (status, typ, treść)"""
+    try:
+        while True:
+            try:
+                request_line = await asyncio.wait_for(reader.readline(), HTTP_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            except ValueError:
+                request_line = b'?'  # linia dłuższa niż limit czytnika -> 400 poniżej
+            if not request_line.strip():
+                break
+            
+            try:
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                if length < 0:
+                    raise ValueError('ujemny Content-Length')
+            except ValueError:
+                # Zła linia żądania, nieliczbowy Content-Length albo za długa linia nagłówka
+                status, content_type, payload = 400, 'text/plain', b'Bad Request'
+                version, headers = 'HTTP/1.0', {'connection': 'close'}
+            else:
+                if length > HTTP_MAX_BODY:
+                    status, content_type, payload = 413, 'text/plain', b'Payload Too Large'
+                    headers['connection'] = 'close'
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    try:
+                        status, content_type, payload = await handler(method, urlsplit(target).path, headers, body)
+                    except Exception as e:
+                        print(f"❌ Błąd serwera HTTP: {e}")
+                        status, content_type, payload = 500, 'text/plain', b'Internal Server Error'
+                    if method == 'HEAD':
+                        payload = b''
+            
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            writer.write(
+                f"{version} {status} {HTTPStatus(status).phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def start_http_server(handler, port, host='0.0.0.0'):
+    """Uruchom serwer HTTP asyncio z podanym handlerem"""
+    return await asyncio.start_server(
+        lambda reader, writer: serve_http_connection(reader, writer, handler), host, port
+    )
+
+def make_bot_routes(application):
+    """Trasy HTTP bota: health check, stan źródeł, metryki i (opcjonalnie) webhook"""
+    
+    async def routes(method, path, headers, body):
+        if method in ('GET', 'HEAD'):
+            if path == '/metrics':
+                return 200, 'text/plain; version=0.0.4; charset=utf-8', render_metrics().encode('utf-8')
+            
+            if path == '/health':
+                # Stan źródeł (opóźnienia, błędy, obwody) i kolejek do hostów
+                return 200, 'application/json; charset=utf-8', json.dumps({
+                    'status': 'ok',
+                    'sources': {label: health.snapshot() for label, health in source_health.items()},
+                    'upstreams': {host: scheduler.snapshot() for host, scheduler in upstream_schedulers.items()},
+                    'startup': startup_snapshot(),
+                }, ensure_ascii=False).encode('utf-8')
+            
+            return 200, 'text/plain; charset=utf-8', b'Live Business Search Bot is running!'
+        
+        if method == 'POST' and WEBHOOK_URL and path == WEBHOOK_PATH:
+            if not secrets.compare_digest(headers.get('x-telegram-bot-api-secret-token', '').encode(), WEBHOOK_SECRET.encode()):
+                return 403, 'text/plain', b'Forbidden'
+            try:
+                data = json.loads(body)
+                if not isinstance(data, dict):
+                    raise ValueError('aktualizacja musi być obiektem JSON')
+                update = Update.de_json(data, application.bot)
+            except (ValueError, TypeError, AttributeError, KeyError):
+                return 400, 'text/plain', b'Bad Request'
+            await application.update_queue.put(update)
+            return 200, 'text/plain', b'OK'
+        
+        return 404, 'text/plain', b'Not Found'
+    
+    return routes
+
+async def stop_http_server():
+    global _http_server
+    if _http_server is not None:
+        _http_server.close()
+        await _http_server.wait_closed()
+        _http_server = None
+
+async def run_webhook(application):
+    """Tryb webhook: aktualizacje przychodzą na ten sam serwer co health check"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    await application.initialize()
+    await on_startup(application)
+    try:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await application.start()
+        print(f"🪝 Webhook: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        await stop.wait()
+    finally:
+        await stop_http_server()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await on_shutdown(application)
+
+# Zadania działające w tle przez cały czas życia bota
+_background_tasks = set()
+
+async def prewarm_upstream(url):
+    """DNS i połączenie (TCP + TLS) do hosta źródła, zanim przyjdzie pierwsze zapytanie"""
+    parts = urlsplit(url)
+    host = parts.hostname
+    try:
+        with startup_phase(f'dns:{host}'):
+            await asyncio.get_running_loop().getaddrinfo(
+                host, parts.port or (443 if parts.scheme == 'https' else 80), type=socket.SOCK_STREAM
+            )
+        # Z pominięciem harmonogramu: jedno HEAD na host przy starcie nie może
+        # zabrać żetonu pierwszemu zapytaniu użytkownika
+        with startup_phase(f'connect:{host}'):
+            # Połączenie zostaje w puli klienta (keep-alive) dla pierwszego zapytania
+            await get_http_client().head(f'{parts.scheme}://{parts.netloc}/', timeout=10)
+    except Exception as e:
+        print(f"Rozgrzewka {host} nieudana: {e}")
+
+def prewarm_storage():
+    """Otwórz bazy SQLite (schemat, WAL) przed pierwszym zapytaniem"""
+    for store in (result_cache, http_cache, name_index, template_store):
+        try:
+            with store._lock:
+                store._connect()
+        except sqlite3.Error as e:
+            print(f"Rozgrzewka {store.path} nieudana: {e}")
+
+async def timed_to_thread(phase, func):
+    with startup_phase(phase):
+        await asyncio.to_thread(func)
+
+async def prewarm():
+    """Rozgrzej w tle wszystko, za co inaczej zapłaciłby pierwszy użytkownik"""
+    hosts = {urlsplit(url).netloc: url for url in (DUCKDUCKGO_URL, OPENCORPORATES_URL, WIKIPEDIA_URL)}
+    with startup_phase('prewarm'):
+        await asyncio.gather(
+            timed_to_thread('import_parsers', import_html_parsers),
+            timed_to_thread('storage', prewarm_storage),
+            *(prewarm_upstream(url) for url in hosts.values()),
+        )
+    mark_milestone('warm')
+
+async def on_startup(application):
+    """Uruchom serwer HTTP i zadania w tle po starcie aplikacji"""
+    global _http_server
+    with startup_phase('http_server'):
+        _http_server = await start_http_server(make_bot_routes(application), PORT)
+    print(f"HTTP server running on port {PORT}")
+    if STARTUP_PREWARM:
+        _background_tasks.add(asyncio.create_task(prewarm()))
+    _background_tasks.add(asyncio.create_task(monitor_event_loop_lag()))
+    if NIP_DUMP_PATH:
+        _background_tasks.add(asyncio.create_task(refresh_nip_index()))
+    with startup_phase('resume_batch'):
+        await resume_batch_jobs(application.bot)
+    mark_milestone('ready')
+
+async def on_shutdown(application):
+    """Zatrzymaj zadania w tle i zamknij połączenia"""
+    await stop_http_server()
+    # Wyszukiwania inline i zadania w tle muszą się zakończyć przed zamknięciem klienta HTTP
+    tasks = list(_background_tasks) + [task for _, task in _inline_tasks.values()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _background_tasks.clear()
+    _inline_tasks.clear()
+    await close_http_client()
+    close_parse_pool()
 
 def main():
     """Główna funkcja bota"""
@@ -546,38 +3136,63 @@ def main():
         print("BŁĄD: Brak BOT_TOKEN!")
         return
     
-    # Uruchom serwer HTTP
-    server_thread = Thread(target=run_server, daemon=True)
-    server_thread.start()
-    
     print("🔍 Uruchamiam Live Business Search Bot...")
+    report_milestone('imports')
     
     try:
-        application = Application.builder().token(token).build()
+        builder = (
+            Application.builder()
+            .token(token)
+            .concurrent_updates(PerChatUpdateProcessor(UPDATE_WORKERS, UPDATE_QUEUE_LIMIT))
+            .post_init(on_startup)
+            .post_shutdown(on_shutdown)
+        )
+        if BOT_API_URL:
+            builder.base_url(f"{BOT_API_URL.rstrip('/')}/bot").base_file_url(f"{BOT_API_URL.rstrip('/')}/file/bot")
+        application = builder.build()
         
         # Dodaj wymagane biblioteki do requirements.txt
-        print("📦 Wymagane biblioteki: requests, beautifulsoup4, lxml")
+        print("📦 Wymagane biblioteki: httpx, beautifulsoup4, lxml")
+        print(f"🔌 Pula HTTP: {HTTP_MAX_CONNECTIONS} połączeń, {HTTP_MAX_PER_HOST}/host, HTTP/2: {'tak' if HTTP2_AVAILABLE else 'nie'}")
+        print(f"🧮 Parsowanie: {f'{PARSE_WORKERS} procesów' if PARSE_WORKERS > 0 else 'w pętli zdarzeń'}")
         
         # Dodaj handlery
         application.add_handler(CommandHandler("start", start))
         application.add_handler(CommandHandler("help", help_command))
         application.add_handler(CommandHandler("szablon", ustaw_szablon))
+        application.add_handler(CommandHandler("batch", batch_command))
+        application.add_handler(InlineQueryHandler(inline_query_handler))
+        application.add_handler(MessageHandler(
+            filters.Document.FileExtension("txt") | filters.Document.FileExtension("csv"), batch_document_handler
+        ))
         
         # Live search dla każdej wiadomości
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, live_search_handler))
         
         print("✅ Live Business Search Bot uruchomiony!")
         print("🌐 Bot wyszukuje na żywo w:")
-        print("   • Polskich rejestrach (KRS/CEIDG)")
+        print(f"   • Polskich rejestrach (KRS/CEIDG) - lokalny indeks NIP: {NIP_INDEX_PATH}")
         print("   • Google Business")
         print("   • OpenCorporates") 
         print("   • Wikipedia")
-        print("🔍 Każde zapytanie = nowe połączenie z internetem")
+        print("📊 Metryki: /metrics, stan źródeł: /health")
+        print(f"⚙️ Równoległa obsługa: {UPDATE_WORKERS} workerów, kolejność zachowana w obrębie czatu")
+        print(f"💾 Cache wyników: {CACHE_DB_PATH} (LRU w pamięci: {CACHE_MEMORY_SIZE})")
         
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if WEBHOOK_URL:
+            asyncio.run(run_webhook(application))
+        else:
+            application.run_polling(allowed_updates=Update.ALL_TYPES)
         
     except Exception as e:
         print(f"❌ Błąd: {e}")
 
+# Bez wypisywania: moduł importują też benchmarki i procesy puli parsowania
+mark_milestone('imports', report=False)
+
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) == 3 and sys.argv[1] == 'import-nip':
+        # Jednorazowy import zrzutu (pełny stan rejestru): python main.py import-nip zrzut.csv
+        nip_index.import_dump(sys.argv[2])
+    else:
+        main()